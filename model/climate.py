@@ -0,0 +1,93 @@
+"""Climatology for anomaly plots, as memory-mapped arrays.
+
+ERA5 climatology netCDF files are converted once into `.npy` arrays of
+shape (time of year, lat, lon), one file per dataset and variable. Plot
+tasks memory-map them and slice their region with a precomputed index
+window, so fetching a reference field costs no decoding at all. Datasets
+are per level already (e.g. `temp850`), so level is part of their name.
+"""
+import datetime
+import logging
+import os
+
+import numpy as np
+from django.conf import settings
+
+from model.grid import Grid, get_window
+
+logger = logging.getLogger(__name__)
+
+
+CLIMATE_RESOLUTION = 0.25
+CLIMATE_INTERVAL = datetime.timedelta(hours=6)
+CLIMATE_DATASETS = (('geopo', 'z'), ('temp850', 't'))
+
+
+class ClimateStore:
+
+    def __init__(self, dataset, var):
+        self.dataset = dataset
+        self.var = var
+        self.grid = Grid(CLIMATE_RESOLUTION)
+
+    @property
+    def source(self):
+        return os.path.join(settings.CLIMATE_DATA_ROOT, self.dataset + '.nc')
+
+    @property
+    def path(self):
+        return os.path.join(settings.CLIMATE_DATA_ROOT, '{}_{}.npy'.format(
+            self.dataset, self.var))
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def build(self):
+        """Convert netCDF file into memory-mappable array, one time slice at a
+        time so that the whole dataset is never held in memory."""
+        import xarray as xr
+        ds = xr.open_dataset(self.source)
+        var = ds.get(self.var)
+        tmp_path = self.path + '.tmp'
+        array = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+            shape=var.shape)
+        for i in range(var.shape[0]):
+            array[i] = var[i].values
+        array.flush()
+        del array
+        ds.close()
+        os.replace(tmp_path, self.path)
+        _climates_.pop(self.path, None)
+        logger.info('Climatology {} built.'.format(self.path))
+
+    def load(self):
+        if self.path not in _climates_:
+            _climates_[self.path] = np.load(self.path, mmap_mode='r').view(np.ndarray)
+        return _climates_[self.path]
+
+    @staticmethod
+    def time_index(time):
+        return (time.replace(year=2000) - datetime.datetime(2000, 1, 1)) // \
+            CLIMATE_INTERVAL
+
+    def get(self, time, georange, step=1):
+        """Climatology at time of year of `time` over georange, latitudes from
+        south to north. Only a view of the mapped file unless the region
+        crosses the seam of the grid or `step` is greater than 1."""
+        window = get_window(self.grid, georange, step=step)
+        return window.apply(self.load()[self.time_index(time)])
+
+
+_climates_ = {}
+
+def get_climatology(dataset, var, time, georange, step=1):
+    store = ClimateStore(dataset, var)
+    if not store.exists():
+        from tools.utils import get_climatological_data
+        logger.warning('Climatology {} not built, reading netCDF.'.format(store.path))
+        return get_climatological_data(dataset, var, time, georange, step=step)
+    return store.get(time, georange, step=step)
+
+def build_all():
+    for dataset, var in CLIMATE_DATASETS:
+        ClimateStore(dataset, var).build()
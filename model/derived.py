@@ -0,0 +1,83 @@
+"""Quantities derived from decoded model fields, e.g. wind speed or vorticity.
+
+A derived field is computed once per (tick, level, quantity) on the whole
+global grid and saved into the field store like a decoded field, under key
+`{level}:{quantity}`. All regional plots of the tick then slice that copy
+instead of running the same finite differences on every region. A derived
+field carries the modification time of the newest source it was computed
+from, and is computed again once any source in the store is newer, e.g. when
+the kicker decoded it again.
+"""
+import os
+
+import numpy as np
+
+EARTH_RADIUS = 6371229.
+
+_derivations_ = {}
+
+
+def derivation(quantity, sources):
+    """Register a function computing `quantity` from fields `sources` of the
+    same level. It gets the grid and raw source arrays (north -> south)."""
+    def wrapper(func):
+        _derivations_[quantity] = (sources, func)
+        return func
+    return wrapper
+
+def is_derived(key):
+    return key.split(':')[-1] in _derivations_
+
+def derived_sources(key):
+    """Pure keys of the fields derived param `key` is computed from."""
+    level, quantity = key.split(':')
+    if quantity not in _derivations_:
+        raise ValueError('Unknown derived quantity: ' + quantity)
+    return ['{}:{}'.format(level, s) for s in _derivations_[quantity][0]]
+
+def get_derived(store, grid, key, tick, load=None):
+    """Return raw global field of derived param `key` like `850:vort`,
+    computing and saving it if no task has done so yet from the current
+    sources. `load(purekey)` gives raw source fields, fields in the store are
+    read by default."""
+    sources = derived_sources(key)
+    # Taken before reading the sources, so that a source replaced while the
+    # field is computed leaves it stale.
+    stamps = [store.mtime(s, tick) for s in sources]
+    derived = store.mtime(key, tick)
+    if derived is not None and all(s is None or s <= derived for s in stamps):
+        return store.get(key, tick)
+    if load is None:
+        load = lambda purekey: store.get(purekey, tick)
+    func = _derivations_[key.split(':')[1]][1]
+    data = func(grid, *[load(s) for s in sources])
+    path = store.put(key, tick, data)
+    # Sources missing before are there now if `load` decoded them.
+    stamps = [stamp or store.mtime(s, tick) for s, stamp in zip(sources, stamps)]
+    stamps = [s for s in stamps if s is not None]
+    if stamps:
+        os.utime(path, ns=(max(stamps), max(stamps)))
+    return store.get(key, tick)
+
+
+@derivation('wind', ('u', 'v'))
+def wind_speed(grid, u, v):
+    return np.hypot(u, v)
+
+@derivation('vort', ('u', 'v'))
+def relative_vorticity(grid, u, v):
+    """dv/dx - du/dy with centered differences, periodic in longitude. Rows at
+    the poles, where dx vanishes, are set to zero."""
+    if u.shape[1] != grid.nx:
+        raise ValueError('Vorticity needs fields covering all longitudes.')
+    lats = np.radians(grid.lat0 - np.arange(u.shape[0]) * grid.resolution)
+    step = np.radians(grid.resolution)
+    dx = EARTH_RADIUS * np.cos(lats)[:, np.newaxis] * step
+    dy = EARTH_RADIUS * step
+    dvdx = (np.roll(v, -1, axis=1) - np.roll(v, 1, axis=1)) / 2
+    # Rows go from north to south, so y decreases with row index.
+    dudy = -np.gradient(u, axis=0) / dy
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vort = np.where(dx > 1., dvdx / dx, 0.) - dudy
+    vort[dx[:, 0] <= 1.] = 0.
+    return vort
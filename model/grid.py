@@ -0,0 +1,87 @@
+"""Index windows of map regions on regular global lat/lon grids.
+
+Label-based selection of a region costs a lot compared to plain slicing, so
+integer windows are computed once per (grid, georange) and applied to raw
+arrays directly. A window is returned as a view of the source array, unless
+the region wraps around the seam of the grid, in which case the two parts
+are concatenated once.
+"""
+import numpy as np
+
+from tools.mapstore import MapArea
+
+
+class Grid:
+    """Global grid with latitudes from `lat0` southward and longitudes from
+    `lon0` eastward, the layout of ECMWF GRIB files and ERA5 netCDF files."""
+
+    def __init__(self, resolution, lat0=90., lon0=0.):
+        self.resolution = resolution
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self.nx = int(round(360 / resolution))
+        self.ny = int(round(180 / resolution)) + 1
+
+    @property
+    def key(self):
+        return self.resolution, self.lat0, self.lon0
+
+    def row(self, lat):
+        return int(round((self.lat0 - lat) / self.resolution))
+
+    def column(self, lon):
+        return int(round((lon - self.lon0) / self.resolution))
+
+
+class Window:
+
+    def __init__(self, rows, columns, step=1):
+        self.rows = rows
+        self.columns = columns
+        self.step = step
+
+    @property
+    def shape(self):
+        ny = len(range(self.rows.start, self.rows.stop, self.step))
+        nx = sum(c.stop - c.start for c in self.columns)
+        return ny, len(range(0, nx, self.step))
+
+    def apply(self, raw):
+        """Return window of `raw` with latitudes flipped to south -> north."""
+        if len(self.columns) == 1:
+            data = raw[self.rows, self.columns[0]]
+        else:
+            data = np.concatenate([raw[self.rows, c] for c in self.columns], axis=1)
+        if self.step > 1:
+            data = data[::self.step, ::self.step]
+        return np.flipud(data)
+
+
+_windows_ = {}
+
+def get_window(grid, georange, step=1):
+    """Window of georange (latmin, latmax, lonmin, lonmax), both ends included.
+    `lonmin` may be greater than `lonmax` for regions crossing the seam of the
+    grid, or negative."""
+    key = grid.key, tuple(georange), step
+    if key in _windows_:
+        return _windows_[key]
+    latmin, latmax, lonmin, lonmax = georange
+    if lonmin > lonmax:
+        lonmax += 360
+    rows = slice(grid.row(latmax), grid.row(latmin) + 1)
+    first = grid.column(lonmin)
+    count = grid.column(lonmax) - first + 1
+    start = first % grid.nx
+    if start + count <= grid.nx:
+        columns = [slice(start, start + count)]
+    else:
+        columns = [slice(start, grid.nx), slice(0, start + count - grid.nx)]
+    window = Window(rows, columns, step=step)
+    _windows_[key] = window
+    return window
+
+def precompute_windows(grid, step=1):
+    """Compute windows of all registered map areas on given grid."""
+    return {key: get_window(grid, area.georange, step=step)
+        for key, area in MapArea.maps.items()}
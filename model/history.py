@@ -0,0 +1,138 @@
+"""Rolling store of decoded fields of the last runs of a model.
+
+Run-to-run comparisons (dprog/dt, trend of consecutive runs) need fields of
+older runs, whose GRIB files and field store are long gone. Every decoded
+field is therefore also packed into a per-run history store:
+
+    {TMP_ROOT}/history/{model}/{YYYYMMDDHH}/{param}.npy   int16 (tick, lat, lon)
+    {TMP_ROOT}/history/{model}/{YYYYMMDDHH}/{param}.json  ticks, scales, offsets
+
+Each tick is a contiguous chunk of the memory-mapped array, packed linearly
+into 16 bits over its own value range like GRIB simple packing, which takes
+half the space of float32 with errors far below model accuracy. Only the
+latest `MODEL_HISTORY_STORE_RUNS` runs are kept, older ones are evicted when
+a new run starts to be written. It lives outside `TMP_ROOT/model`, which the
+hourly cleaner empties of all but the latest run.
+"""
+import datetime
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+HISTORY_RUNS = getattr(settings, 'MODEL_HISTORY_STORE_RUNS', 6)
+PACKED_MAX = 65534
+FILL_VALUE = -32768
+
+
+class RunHistory:
+
+    def __init__(self, model, runs=HISTORY_RUNS):
+        self.model = model
+        self.runs = runs
+        self.root = os.path.join(settings.TMP_ROOT, 'history', model)
+
+    def run_dir(self, basetime):
+        return os.path.join(self.root, basetime.strftime('%Y%m%d%H'))
+
+    def paths(self, basetime, paramkey):
+        path = os.path.join(self.run_dir(basetime), paramkey.replace(':', '-'))
+        return path + '.npy', path + '.json'
+
+    def list_runs(self):
+        """Basetimes of stored runs, latest first."""
+        if not os.path.isdir(self.root):
+            return []
+        runs = [datetime.datetime.strptime(d, '%Y%m%d%H') for d in
+            os.listdir(self.root) if len(d) == 10 and d.isdigit()]
+        return sorted(runs, reverse=True)
+
+    def load_meta(self, basetime, paramkey):
+        meta_path = self.paths(basetime, paramkey)[1]
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def put(self, basetime, paramkey, tick, data, ticks):
+        """Pack field of a tick into the run. `ticks` are all ticks of the run,
+        used to allocate the array when the param is first written. Not safe
+        for concurrent writers of the same run, which the kicker never has."""
+        array_path, meta_path = self.paths(basetime, paramkey)
+        meta = self.load_meta(basetime, paramkey)
+        if meta is None:
+            os.makedirs(self.run_dir(basetime), exist_ok=True)
+            meta = {'ticks': list(ticks), 'shape': list(data.shape),
+                'scale': [None] * len(ticks), 'offset': [None] * len(ticks)}
+            array = np.lib.format.open_memmap(array_path, mode='w+',
+                dtype=np.int16, shape=(len(ticks),) + data.shape)
+            array[:] = FILL_VALUE
+            self.evict()
+        else:
+            array = np.load(array_path, mmap_mode='r+')
+        index = meta['ticks'].index(tick)
+        packed, scale, offset = pack(data)
+        array[index] = packed
+        array.flush()
+        del array
+        meta['scale'][index] = scale
+        meta['offset'][index] = offset
+        # Readers only trust ticks listed with a scale in the metadata, which
+        # is replaced atomically after the data are in place.
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def get(self, basetime, paramkey, tick):
+        """Unpacked float32 field, None if the run doesn't have it."""
+        meta = self.load_meta(basetime, paramkey)
+        if meta is None or tick not in meta['ticks']:
+            return None
+        index = meta['ticks'].index(tick)
+        if meta['scale'][index] is None:
+            return None
+        array = np.load(self.paths(basetime, paramkey)[0], mmap_mode='r')
+        return unpack(array[index], meta['scale'][index], meta['offset'][index])
+
+    def get_valid(self, paramkey, valid_time, runs=None):
+        """Forecasts of all stored runs valid at `valid_time`, latest run
+        first, as a list of (basetime, tick, field)."""
+        result = []
+        for basetime in self.list_runs()[:runs]:
+            hours = (valid_time - basetime).total_seconds() / 3600
+            if hours < 0 or hours != int(hours):
+                continue
+            field = self.get(basetime, paramkey, int(hours))
+            if field is not None:
+                result.append((basetime, int(hours), field))
+        return result
+
+    def evict(self):
+        for basetime in self.list_runs()[self.runs:]:
+            logger.info('Evict run {} from history.'.format(basetime))
+            shutil.rmtree(self.run_dir(basetime), ignore_errors=True)
+
+
+def pack(data):
+    data = np.asarray(data, dtype=np.float32)
+    finite = np.isfinite(data)
+    if not finite.any():
+        return np.full(data.shape, FILL_VALUE, dtype=np.int16), 1., 0.
+    vmin = float(data[finite].min())
+    vmax = float(data[finite].max())
+    scale = (vmax - vmin) / PACKED_MAX or 1.
+    packed = np.round((data - vmin) / scale) - 32767
+    packed[~finite] = FILL_VALUE
+    return packed.astype(np.int16), scale, vmin
+
+def unpack(packed, scale, offset):
+    data = (packed.astype(np.float32) + 32767) * np.float32(scale) + \
+        np.float32(offset)
+    data[packed == FILL_VALUE] = np.nan
+    return data
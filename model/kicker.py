@@ -1,26 +1,36 @@
 import datetime
-import ftplib
 import logging
 import os
+import queue
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-import numpy as np
 import xarray as xr
-from celery import shared_task
+from celery import chord, shared_task
 from django.conf import settings
-from django.core.cache import cache
 
+from model.derived import derived_sources, get_derived, is_derived
+from model.grid import Grid, get_window
+from model.history import RunHistory
 from model.param import Param
+from model.profiling import profiled, profiler
 from model.registry import PlotTask, registry_center
-from tools.fastdown import SerialFTPFastDown
+from model.scheduler import PlotScheduler
+from model.status import label_finished, label_tick_codes, models_runtime
+from model.store import FieldStore, release_fields
+from tools import ledger
+from tools.fastdown import (FTPConnectionPool, FTPDirectoryWatcher,
+                            PooledFTPFastDown)
 from tools.mapstore import MapArea, get_areas
 from tools.utils import utc_last_tick
 
 logger = logging.getLogger(__name__)
 
-
-models_runtime = {'ecmwf': list(range(0, 241, 24))}
-MODEL_HISTORY_RUNS = 5
+# Regions of a code rendered by one task. Batches share decoded fields and
+# colormaps, several batches of a code render in parallel on all workers.
+MODEL_BATCH_REGIONS = 8
 
 
 class ModelException(Exception):
@@ -37,22 +47,26 @@ def plot_ecmwf():
 
 class Kicker:
 
-    clocks = iter(range(0, 241, 24))
     min_clock = 0
     max_clock = 240
     modelkey = None
 
     def __init__(self):
+        self.clocks = iter(range(self.min_clock, self.max_clock + 1, 24))
         self.time = None
         self.try_round = True
         self.next_round = True
         self.tick = None
         self.failed = 0
         self.codes = None
+        self.force = False
 
-    def kick(self, time=None, codes=None, start=None):
+    def kick(self, time=None, codes=None, start=None, force=False):
+        """If force is True, plots are rendered even if an identical image
+        exists already."""
         if codes is not None:
             self.codes = codes
+        self.force = force
         if time is None:
             self.get_time()
         else:
@@ -60,16 +74,16 @@ class Kicker:
         if start is not None:
             self.clocks = iter(range(start, 241, 24))
         self.establish()
-        while True:
-            try:
-                self.clock()
-            except StopIteration:
-                break
-            self.check_and_download()
-            self.wait()
-        self.destroy()
-        # except Exception as exp:
-        #     logger.exception('Unknown error')
+        try:
+            while True:
+                try:
+                    self.clock()
+                except StopIteration:
+                    break
+                self.check_and_download()
+                self.wait()
+        finally:
+            self.destroy()
 
     def get_time(self):
         pass
@@ -97,6 +111,17 @@ class Kicker:
 ECMWF_FTP_ADDRESS = 'data-portal.ecmwf.int'
 ECMWF_FTP_USERNAME = 'wmo'
 ECMWF_FTP_PASSWORD = 'essential'
+ECMWF_FTP_CONNECTIONS = 4
+# Rough dissemination schedule of the WMO essential dataset, which is only
+# used to decide how often to list the FTP directory.
+ECMWF_RELEASE_DELAY = datetime.timedelta(hours=6, minutes=40)
+ECMWF_RELEASE_STEP = datetime.timedelta(minutes=5)
+ECMWF_POLL_WINDOW = datetime.timedelta(minutes=15)
+ECMWF_MIN_POLL_INTERVAL = 20
+ECMWF_MAX_POLL_INTERVAL = 600
+ECMWF_MAX_OVERDUE = datetime.timedelta(hours=4)
+# Ticks being downloaded at the same time, they share the FTP connections.
+ECMWF_MAX_INFLIGHT_TICKS = 2
 
 class ECMWFKicker(Kicker):
 
@@ -117,38 +142,84 @@ class ECMWFKicker(Kicker):
         logger.info('ECMWF Kicker task: {}'.format(self.time.strftime('%Y%m%d%H')))
 
     def establish(self):
-        self.ftp = ftplib.FTP(ECMWF_FTP_ADDRESS, ECMWF_FTP_USERNAME,
-            ECMWF_FTP_PASSWORD)
+        self.pool = FTPConnectionPool(ECMWF_FTP_ADDRESS, ECMWF_FTP_USERNAME,
+            ECMWF_FTP_PASSWORD, size=ECMWF_FTP_CONNECTIONS)
+        # Fail early if the server is unreachable or refuses our login.
+        self.pool.release(self.pool.acquire())
         self.params = registry_center.get_params(self.modelkey)
-        self.downer = SerialFTPFastDown(retry=2)
-        self.downer.set_ftp(self.ftp)
-        self.downer.set_success_callback(self.callback)
+        self.watcher = FTPDirectoryWatcher(self.pool, self.time.strftime('%Y%m%d%H0000'))
+        self.pending = list(self.clocks)
+        self.fetched = set()
+        self.requested = set()
+        self.fetch_lock = threading.Lock()
+        self.scheduler = PlotScheduler(self.modelkey, self.pending, codes=self.codes)
+        # The run goes through a pipeline: the main thread lists the directory
+        # and hands files to download threads, one per tick and at most
+        # ECMWF_MAX_INFLIGHT_TICKS of them. Downloaded files are decoded and
+        # their plots dispatched by a single decoder thread, so that the next
+        # tick is downloaded while the previous one is decoded.
+        self.downloads = ThreadPoolExecutor(max_workers=ECMWF_MAX_INFLIGHT_TICKS)
+        self.inflight = {}
+        self.decode_queue = queue.Queue()
+        self.decoder = threading.Thread(target=self.decode_loop, daemon=True)
+        self.decoder.start()
         tmp_path = os.path.join(settings.TMP_ROOT, self.time.strftime('model/%Y%m%d%H'),
             self.modelkey)
         os.makedirs(tmp_path, exist_ok=True)
         logger.info('ECMWF ftp connection established.')
 
     def clock(self):
-        if self.next_round:
-            self.tick = next(self.clocks)
+        self.reap()
+        if not self.pending:
+            raise StopIteration
+        # Wait for the first tick whose files haven't been all listed yet.
+        waiting = [t for t in self.pending if self.unlisted(t)]
+        tick = waiting[0] if waiting else self.pending[0]
+        if self.tick != tick:
+            self.tick = tick
             logger.info('Clock: {}'.format(self.tick))
-            self.failed = 0
-            self.try_round = True
-            self.next_round = False
+
+    def unlisted(self, tick):
+        """Params of given tick whose files haven't been listed yet."""
+        return [p for p in self.params if self.param_to_filename(p, tick) \
+            not in self.watcher.listed]
+
+    def expected_release(self, tick):
+        """Estimated time when files of given tick appear on the FTP server."""
+        return self.time + ECMWF_RELEASE_DELAY + ECMWF_RELEASE_STEP * (tick // 24)
+
+    def poll_interval(self):
+        """Seconds to wait before next listing. Sleep long until shortly before
+        the next step is expected, poll quickly around that time, then back off
+        gradually if data are late. Once all files are listed, only downloads
+        are waited for."""
+        if not self.unlisted(self.tick):
+            return ECMWF_MIN_POLL_INTERVAL
+        now = datetime.datetime.utcnow()
+        expected = self.expected_release(self.tick)
+        if now < expected - ECMWF_POLL_WINDOW:
+            ahead = expected - ECMWF_POLL_WINDOW - now
+            return min(ahead.total_seconds(), ECMWF_MAX_POLL_INTERVAL)
+        if now < expected + ECMWF_POLL_WINDOW:
+            return ECMWF_MIN_POLL_INTERVAL
+        overdue = now - expected
+        # A late run is still fetched as long as its files keep appearing.
+        if overdue > ECMWF_MAX_OVERDUE and self.failed:
+            raise ModelException('Data of tick {} overdue for {}.'.format(self.tick,
+                overdue))
+        if overdue < datetime.timedelta(hours=1):
+            return 60
+        return 180
 
     def wait(self):
-        if not (self.try_round or self.next_round):
+        if not self.pending:
             return
-        if self.failed == 0:
-            time.sleep(3)
-        elif self.failed < 15:
-            logger.debug('Wait for 1 min. Failed: {}'.format(self.failed))
-            time.sleep(60)
-        elif self.failed < 25:
-            logger.debug('Wait for 3 min. Failed: {}'.format(self.failed))
-            time.sleep(180)
-        else:
-            raise ModelException('Too much failed times.')
+        interval = self.poll_interval()
+        logger.debug('Wait for {:.0f}s. Failed: {}'.format(interval, self.failed))
+        if interval > 30:
+            # Keep idle FTP connections of the pool alive across long waits.
+            self.pool.ping()
+        time.sleep(interval)
 
     def param_to_link(self, paramkey, tick):
         parameter, level, suffix = self._productdict_[paramkey]
@@ -156,7 +227,7 @@ class ECMWFKicker(Kicker):
         if tick == 0:
             fcststr = 'an'
         else:
-            fcststr = str(self.tick) + 'h'
+            fcststr = str(tick) + 'h'
         ftpfile = '{0}/A_H{1}X{2}{3}ECMF{4}_C_ECMF_{5}_{6}_{7}_global_0p5deg_grib2.bin'\
             ''.format(self.time.strftime('%Y%m%d%H0000'), parameter, timechar, level,
                 self.time.strftime('%d%H00'), self.time.strftime('%Y%m%d%H0000'),
@@ -169,78 +240,153 @@ class ECMWFKicker(Kicker):
             self.modelkey, path)
         return path
 
+    def param_to_filename(self, paramkey, tick):
+        return os.path.basename(self.param_to_link(paramkey, tick))
+
     def check_and_download(self):
-        if self.try_round:
-            logger.info('Try round.')
-            test_param = self.params[0]
-            source = self.param_to_link(test_param, self.tick)
-            target = self.param_to_path(test_param, self.tick)
-            callback_args = self, test_param
-            self.downer.set_task([(source, target, callback_args)])
-            try:
-                self.downer.download()
-            except Exception as exp:
-                self.failed += 1
-            else:
-                logger.info('Try round succeeded!')
-                self.try_round = False
+        """List the run directory once, then hand files which have appeared
+        to download threads, earliest ticks first."""
+        try:
+            new_files = self.watcher.poll()
+        except Exception as exp:
+            self.failed += 1
+            logger.exception('Listing failed. Failed: {}'.format(self.failed))
+            return
+        if new_files:
+            logger.info('{} new files listed.'.format(len(new_files)))
+            self.failed = 0
         else:
-            logger.info('Fire round.')
-            params = self.params[1:]
-            tasks = [(self.param_to_link(p, self.tick), self.param_to_path(p, self.tick),
-                (self, p)) for p in params]
-            self.downer.set_task(tasks)
+            self.failed += 1
+        for tick in self.pending:
+            if tick in self.inflight:
+                continue
+            if len(self.inflight) >= ECMWF_MAX_INFLIGHT_TICKS:
+                break
+            with self.fetch_lock:
+                params = [p for p in self.params if (tick, p) not in self.requested \
+                    and self.param_to_filename(p, tick) in self.watcher.listed]
+                self.requested.update((tick, p) for p in params)
+            if not params:
+                continue
+            params = self.scheduler.order_params(tick, params)
+            self.inflight[tick] = self.downloads.submit(self.download_tick, tick,
+                params)
+
+    def download_tick(self, tick, params):
+        downer = PooledFTPFastDown(retry=2)
+        downer.set_pool(self.pool)
+        downer.set_success_callback(self.callback)
+        downer.set_task([(self.param_to_link(p, tick), self.param_to_path(p, tick),
+            (self, tick, p)) for p in params])
+        try:
+            downer.download()
+        except Exception as exp:
+            logger.exception('Download failed. Tick: {}'.format(tick))
+        finally:
+            with self.fetch_lock:
+                # Files failed to download are requested again on next listing.
+                self.requested.difference_update((tick, p) for p in params \
+                    if (tick, p) not in self.fetched)
+
+    def reap(self):
+        """Forget finished downloads and ticks which have been fully fetched."""
+        for tick, future in list(self.inflight.items()):
+            if future.done():
+                del self.inflight[tick]
+        with self.fetch_lock:
+            finished = [t for t in self.pending if t not in self.inflight and \
+                all((t, p) in self.fetched for p in self.params)]
+        for tick in finished:
+            logger.info('Tick {} finished.'.format(tick))
+            self.pending.remove(tick)
+
+    def callback(_, filename, callback_args):
+        kicker, tick, paramkey = callback_args
+        with kicker.fetch_lock:
+            kicker.fetched.add((tick, paramkey))
+        kicker.decode_queue.put((filename, tick, paramkey))
+
+    def decode_loop(self):
+        while True:
+            item = self.decode_queue.get()
+            if item is None:
+                break
             try:
-                self.downer.download()
+                self.handle_download(*item)
             except Exception as exp:
-                self.failed += 1
-                logger.exception('Fire round failed. Failed: {}'.format(self.failed))
-            else:
-                logger.info('Fire round succeeded!')
-                self.next_round = True
+                logger.exception('Failed to handle {}.'.format(item[0]))
 
-    def callback(_, filename, callback_args):
-        kicker, paramkey = callback_args
+    def handle_download(self, filename, tick, paramkey):
         logger.debug('{} downloaded.'.format(filename))
-        plot_tasks = registry_center.get_tasks(kicker.modelkey, paramkey)
-        for task in plot_tasks:
-            if kicker.codes is not None and task.code not in kicker.codes:
-                continue
-            if not kicker.validate(task):
-                continue
-            if kicker.tick in task.requested_ticks:
-                continue
-            if task.plevel is None:
-                plevel = [0 for i in range(len(task.regions))]
-            elif isinstance(task.plevel, int):
-                plevel = [task.plevel for i in range(len(task.regions))]
-            elif isinstance(task.plevel, (list, tuple)):
-                assert len(task.plevel) == len(task.regions)
-                plevel = task.plevel
-            else:
-                raise ModelException('Invalid plevel configuration.')
-            task.requested_ticks.append(kicker.tick)
-            logger.info('A set of plot task prepared: Code: {}'.format(task.code))
-            for pl, re in zip(plevel, task.regions):
-                regions = get_areas(re)
-                for region in regions:
-                    session = Session(resolution=kicker.resolution, region=region,
-                        basetime=kicker.time, fcsthour=kicker.tick, plevel=pl)
-                    session.set_plot_task(task)
-                    common_plot.apply_async(args=(task.to_json(), session.to_json()),
-                        retry=True, ignore_result=True, priority=task.priority)
-                    time.sleep(0.1)
-
-    def validate(self, task):
-        flag = all(os.path.exists(self.param_to_path(paramkey, self.tick)) \
-            for paramkey in task.params)
-        return flag
+        try:
+            self.decode(paramkey, tick)
+        except Exception as exp:
+            logger.exception('Failed to decode {}.'.format(filename))
+            return
+        ready = self.scheduler.land(tick, paramkey)
+        for node_tick in sorted(set(node.tick for node in ready)):
+            self.dispatch([node for node in ready if node.tick == node_tick],
+                node_tick)
+
+    def dispatch(self, nodes, tick):
+        """Send plots of a tick which became ready together as one chord, its
+        callback marks their codes finished and closes the tick once all codes
+        of the tick are done."""
+        header = []
+        for node in nodes:
+            for sessions in self.make_batches(node.task, tick):
+                header.append(batch_plot.s(node.task.to_json(), sessions,
+                    self.force).set(priority=node.priority))
+        codes = [node.task.code for node in nodes]
+        chord(header)(finish_plots.s(self.modelkey, self.time.strftime('%Y%m%d%H'),
+            tick, codes, self.scheduler.count(tick)))
+        logger.info('{} plot tasks dispatched. Tick: {} Codes: {}'.format(
+            len(header), tick, codes))
+
+    def make_batches(self, task, tick):
+        if task.plevel is None:
+            plevel = [0 for i in range(len(task.regions))]
+        elif isinstance(task.plevel, int):
+            plevel = [task.plevel for i in range(len(task.regions))]
+        elif isinstance(task.plevel, (list, tuple)):
+            assert len(task.plevel) == len(task.regions)
+            plevel = task.plevel
+        else:
+            raise ModelException('Invalid plevel configuration.')
+        sessions = []
+        for pl, re in zip(plevel, task.regions):
+            regions = self.scheduler.order_regions(task.code, get_areas(re))
+            for region in regions:
+                session = Session(resolution=self.resolution, region=region,
+                    basetime=self.time, fcsthour=tick, plevel=pl)
+                session.set_plot_task(task)
+                sessions.append(session.to_json())
+        return [sessions[i:i + MODEL_BATCH_REGIONS] for i in range(0,
+            len(sessions), MODEL_BATCH_REGIONS)]
+
+    def decode(self, paramkey, tick):
+        """Decode GRIB file once into the shared field store, so that plot
+        tasks don't need to run cfgrib themselves."""
+        store = FieldStore(self.modelkey, self.time)
+        ds = get_dataset(self.modelkey, self.time, paramkey, tick)
+        store.put_dataset(paramkey, tick, ds)
+        try:
+            RunHistory(self.modelkey).put(self.time, paramkey, tick,
+                store.get(paramkey, tick), models_runtime[self.modelkey])
+        except Exception as exp:
+            logger.exception('Failed to keep {} of tick {} in history.'.format(
+                paramkey, tick))
 
     def destroy(self):
+        self.downloads.shutdown(wait=True)
+        self.decode_queue.put(None)
+        self.decoder.join()
         close_all_datasets()
-        self.ftp.close()
-        for task in registry_center.iter_tasks(self.modelkey):
-            task.requested_ticks = []
+        self.pool.close()
+        pending = self.scheduler.pending()
+        if pending:
+            logger.warning('{} plots never got all their fields.'.format(
+                len(pending)))
         logger.info('Kicker task finished.')
 
 
@@ -256,34 +402,78 @@ def common_plot(self, plot_task_json, session_json):
     logger.info('Starting a common plot task. Model: {} Code: {} '
         'Time: {} Region: {} ID: {}'.format(plot_task.model, plot_task.code,
             session.fcsthour, session.region.key, self.request.id))
+    profiler.start()
     try:
         plot_task.plotfunc(session)
     except Exception as exp:
         logger.exception('Fatal error during plotting.')
+        profiler.record(plot_task.model, plot_task.code, session.region.key,
+            session.fcsthour, failed=True)
         raise exp
     else:
+        profiler.record(plot_task.model, plot_task.code, session.region.key,
+            session.fcsthour)
         label_finished(plot_task.model, session.region.pkey, plot_task.code,
             session.basetime, session.fcsthour)
         logger.info('Plot task finished. ID: {}'.format(self.request.id))
 
-
-def label_finished(model, region, code, basetime, tick=None):
-    """If tick is None, it will create a empty status list."""
-    key = 'STATUS_{}_{}_{}'.format(model, region, code)
-    basetime_str = basetime.strftime('%Y%m%d%H')
-    status = cache.get(key) or []
-    if not status or status[0]['time'] != basetime_str:
-        status.insert(0, {'time': basetime_str, 'ticks': [], 'pending': [], 'updating': True})
-        if len(status) > MODEL_HISTORY_RUNS:
-            status = status[:MODEL_HISTORY_RUNS]
-    runtime = models_runtime.get(model)
-    if tick is not None and tick not in status[0]['ticks']:
-        status[0]['ticks'].append(tick)
-        status[0]['ticks'].sort()
-        status[0]['pending'] = [r for r in runtime if r not in status[0]['ticks']]
-    if tick == max(runtime):
-        status[0]['updating'] = False
-    cache.set(key, status, 30 * 86400)
+@shared_task(bind=True)
+def batch_plot(self, plot_task_json, session_jsons, force=False):
+    """Plot a batch of regions of one code and one tick in a single task.
+    Fields are memory-mapped from the field store once and colormaps are parsed
+    once, only the map differs from region to region. Regions already rendered
+    from the same fields by the same plot function are skipped unless `force`.
+    Failed regions are counted in the result rather than raised, so that the
+    chord callback still runs."""
+    plot_task = PlotTask.from_json(plot_task_json)
+    logger.info('Starting a batch plot task. Model: {} Code: {} Regions: {} '
+        'ID: {}'.format(plot_task.model, plot_task.code, len(session_jsons),
+            self.request.id))
+    failed = 0
+    skipped = 0
+    for session_json in session_jsons:
+        profiler.start()
+        try:
+            session = Session.from_json(session_json)
+            session.make()
+            if not force and ledger.is_rendered(session.target_path,
+                    session.fingerprint(plot_task)):
+                skipped += 1
+                label_finished(plot_task.model, session.region.pkey,
+                    plot_task.code, session.basetime, session.fcsthour)
+                continue
+            plot_task.plotfunc(session)
+            # Fields decoded during plotting change the fingerprint.
+            ledger.record(session.target_path, session.fingerprint(plot_task))
+        except Exception as exp:
+            failed += 1
+            logger.exception('Fatal error during plotting. Region: {}'.format(
+                session_json['region']))
+            profiler.record(plot_task.model, plot_task.code, session_json['region'],
+                session_json['fcsthour'], failed=True)
+        else:
+            profiler.record(plot_task.model, plot_task.code, session_json['region'],
+                session_json['fcsthour'])
+            label_finished(plot_task.model, session.region.pkey, plot_task.code,
+                session.basetime, session.fcsthour)
+    if failed:
+        logger.error('{} of {} regions failed. Code: {}'.format(failed,
+            len(session_jsons), plot_task.code))
+    logger.info('Batch plot task finished. Skipped: {} ID: {}'.format(skipped,
+        self.request.id))
+    return {'code': plot_task.code, 'regions': len(session_jsons),
+        'failed': failed, 'skipped': skipped}
+
+@shared_task(ignore_result=True)
+def finish_plots(results, model, time, tick, codes, expected):
+    """Chord callback of a dispatch, see `ECMWFKicker.dispatch`."""
+    failed = sum(r['failed'] for r in results)
+    if failed:
+        logger.warning('{} regions failed. Time: {} Tick: {} Codes: {}'.format(
+            failed, time, tick, codes))
+    if label_tick_codes(model, time, tick, codes, expected):
+        logger.info('All plots finished. Model: {} Time: {} Tick: {}'.format(
+            model, time, tick))
 
 
 class Session:
@@ -301,13 +491,7 @@ class Session:
         self.plevel = plevel
 
     def slice_indices(self):
-        latmin, latmax, lonmin, lonmax = self.georange
-        self.xmin = int(lonmin / self.resolution)
-        self.xmax = int(lonmax / self.resolution)
-        if lonmax == 360:
-            self.xmax -= 1
-        self.ymax = int((90 - latmin) / self.resolution)
-        self.ymin = int((90 - latmax) / self.resolution)
+        self.window = get_window(Grid(self.resolution), self.georange)
 
     def set_plot_task(self, task):
         self.model = task.model
@@ -356,68 +540,202 @@ class Session:
         os.makedirs(os.path.dirname(self.target_path), exist_ok=True)
         self.slice_indices()
 
+    def param_tick(self, param):
+        """Tick of the field read for param, None if it's out of the run."""
+        if param.time is None:
+            return self.fcsthour
+        tick = self.fcsthour + int(param.time)
+        runtime = models_runtime[self.model]
+        if tick < runtime[0] or tick > runtime[-1]:
+            return None
+        return tick
+
+    @profiled('get')
     def get(self, paramkey):
         if paramkey not in self.params:
             raise ValueError('Session has no param named ' + paramkey)
         param = Param.from_str(paramkey)
-        if param.time is not None:
-            tick = self.fcsthour + param.time
-            if tick < self.min_clock or tick > self.max_clock:
-                return None
-        else:
-            tick = self.fcsthour
-        ds = get_dataset(self.model, self.basetime, param.purekey, tick)
-        latmin, latmax, lonmin, lonmax = self.georange
-        default_key = list(ds.data_vars)[0]
-        raw = ds.get(default_key)
-        if lonmin > lonmax:
-            first_half = np.flipud(raw[self.ymin:self.ymax+1, self.xmax:])
-            second_half = np.flipud(raw[self.ymin:self.ymax+1, :self.xmin+1])
-            return np.hstack((first_half, second_half))
-        else:
-            data = np.flipud(np.asanyarray(raw[self.ymin:self.ymax+1,
-                self.xmin:self.xmax+1]))
-            # if self.xmin == 0 and self.xmax == raw.shape[1] - 1:
-            #     data = np.c_[data, data[:, 0]]
-            return data
+        tick = self.param_tick(param)
+        if tick is None:
+            return None
+        return self.window.apply(self.load(param.purekey, tick))
+
+    def load(self, purekey, tick):
+        """Raw global field from the field store."""
+        store = FieldStore(self.model, self.basetime)
+        if not store.exists(purekey, tick):
+            # Kicker failed to decode it, do it here once for all other tasks.
+            store.put_dataset(purekey, tick, get_dataset(self.model,
+                self.basetime, purekey, tick))
+        return store.get(purekey, tick)
+
+    @profiled('get')
+    def derive(self, key):
+        """Derived quantity of this tick by name, like `850:wind` or
+        `850:vort`, see `model.derived`. Its sources must be params of the
+        session, which makes them part of the fingerprint."""
+        for purekey in derived_sources(key):
+            if purekey not in self.params:
+                raise ValueError('Session has no param named ' + purekey)
+        store = FieldStore(self.model, self.basetime)
+        raw = get_derived(store, Grid(self.resolution), key, self.fcsthour,
+            load=lambda purekey: self.load(purekey, self.fcsthour))
+        return self.window.apply(raw)
+
+    def history(self, paramkey, runs=None):
+        """Forecasts of param valid at the same time as this session from the
+        latest `runs` runs in the history store, this run included if it's
+        there, as a list of (basetime, tick, field over the region)."""
+        if paramkey not in self.params:
+            raise ValueError('Session has no param named ' + paramkey)
+        param = Param.from_str(paramkey)
+        tick = self.param_tick(param)
+        if tick is None:
+            return []
+        valid_time = self.basetime + datetime.timedelta(hours=tick)
+        return [(basetime, t, self.window.apply(field)) for basetime, t, field in
+            RunHistory(self.model).get_valid(param.purekey, valid_time, runs=runs)]
 
     def get_mapset(self):
         return self.region.load()
 
-
-
-_opened_datasets_ = {}
-_recent_used_datasets_ = []
-MAX_CACHED_DATASETS = 5
-
-def get_dataset(model, basetime, paramkey, tick):
-    id_key = model, basetime, paramkey, tick
-    if id_key in _recent_used_datasets_:
-        ds = _opened_datasets_[id_key]
-        _recent_used_datasets_.insert(0, _recent_used_datasets_.pop(
-            _recent_used_datasets_.index(id_key)))
+    def fingerprint(self, plot_task):
+        """Identity of everything the image is made from, see `tools.ledger`."""
+        store = FieldStore(self.model, self.basetime)
+        files = [self.region.path]
+        for paramkey in self.params:
+            param = Param.from_str(paramkey)
+            tick = self.param_tick(param)
+            if tick is None:
+                continue
+            files.append(store.path(param.purekey, tick))
+            if is_derived(param.purekey):
+                # A derived field is only recomputed once read, its sources
+                # tell whether it will change.
+                files.extend(store.path(s, tick) for s in derived_sources(
+                    param.purekey))
+        return ledger.fingerprint(self.code, self.region.key, self.georange,
+            self.resolution, self.plevel, self.basetime, self.fcsthour,
+            ledger.code_identity(plot_task.plotfunc), files=files)
+
+
+
+MAX_CACHED_DATASET_BYTES = 512 * 1024 * 1024
+
+
+class DatasetCache:
+    """LRU of opened datasets, keyed by file path and cfgrib filter, and bounded
+    by estimated size of the data they hold rather than by number of entries.
+    A file written again since it was opened, e.g. downloaded anew, is opened
+    again. Evicted datasets are closed. It can be shared between threads."""
+
+    def __init__(self, max_bytes=MAX_CACHED_DATASET_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.datasets = OrderedDict()
+        self.sizes = {}
+        self.stamps = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(path, filter_by_keys=None):
+        if not filter_by_keys:
+            return path, ()
+        return path, tuple(sorted(filter_by_keys.items()))
+
+    def open(self, path, filter_by_keys=None):
+        if filter_by_keys:
+            return xr.open_dataset(path, engine='cfgrib',
+                backend_kwargs={'filter_by_keys': filter_by_keys})
+        return xr.open_dataset(path, engine='cfgrib')
+
+    def get(self, path, filter_by_keys=None):
+        key = self.make_key(path, filter_by_keys)
+        stat = os.stat(path)
+        stamp = stat.st_size, stat.st_mtime_ns
+        stale = None
+        with self.lock:
+            if key in self.datasets:
+                if self.stamps[key] == stamp:
+                    self.hits += 1
+                    self.datasets.move_to_end(key)
+                    return self.datasets[key]
+                stale = self._remove(key)
+            self.misses += 1
+        if stale is not None:
+            stale.close()
+        # Open without holding the lock, decoding index of a GRIB file is slow.
+        ds = self.open(path, filter_by_keys)
+        with self.lock:
+            if key in self.datasets and self.stamps[key] == stamp:
+                # Opened by another thread meanwhile, keep that one.
+                ds.close()
+                self.datasets.move_to_end(key)
+                return self.datasets[key]
+            # Another thread may have opened an older version meanwhile.
+            evicted = [self._remove(key)] if key in self.datasets else []
+            self.datasets[key] = ds
+            self.sizes[key] = ds.nbytes
+            self.stamps[key] = stamp
+            self.total_bytes += ds.nbytes
+            evicted += self._evict()
+        for old_ds in evicted:
+            old_ds.close()
         return ds
+
+    def _remove(self, key):
+        self.total_bytes -= self.sizes.pop(key)
+        del self.stamps[key]
+        return self.datasets.pop(key)
+
+    def _evict(self):
+        evicted = []
+        # The newest entry is always kept even if it alone exceeds the bound.
+        while self.total_bytes > self.max_bytes and len(self.datasets) > 1:
+            evicted.append(self._remove(next(iter(self.datasets))))
+            self.evictions += 1
+        return evicted
+
+    def clear(self):
+        with self.lock:
+            datasets = list(self.datasets.values())
+            self.datasets.clear()
+            self.sizes.clear()
+            self.stamps.clear()
+            self.total_bytes = 0
+        for ds in datasets:
+            ds.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.datasets),
+                'bytes': self.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+dataset_cache = DatasetCache(getattr(settings, 'MODEL_DATASET_CACHE_BYTES',
+    MAX_CACHED_DATASET_BYTES))
+
+def get_dataset(model, basetime, paramkey, tick, filter_by_keys=None):
     path = '{}_{}.grib2'.format(tick, paramkey.replace(':', '-'))
     path = os.path.join(settings.TMP_ROOT, 'model',
         '{}/{}'.format(basetime.strftime('%Y%m%d%H'), model), path)
-    ds = xr.open_dataset(path, engine='cfgrib')
-    _opened_datasets_[id_key] = ds
-    _recent_used_datasets_.insert(0, id_key)
-    if len(_recent_used_datasets_) > MAX_CACHED_DATASETS:
-        purged_id_key = _recent_used_datasets_.pop(-1)
-        purged_ds = _opened_datasets_.pop(purged_id_key)
-        purged_ds.close()
-    return ds
+    return dataset_cache.get(path, filter_by_keys)
 
 def close_all_datasets():
-    for ds in _opened_datasets_.values():
-        ds.close()
-    _opened_datasets_.clear()
-    _recent_used_datasets_.clear()
+    logger.debug('Dataset cache: {}'.format(dataset_cache.stats()))
+    dataset_cache.clear()
+    release_fields()
 
-def _debug_ec(time, codes=None):
+def _debug_ec(time, codes=None, force=False):
     logger.info('Debug: {} Codes: {}'.format(time, codes))
-    ECMWFKicker().kick(time, codes=codes)
+    ECMWFKicker().kick(time, codes=codes, force=force)
 
 def _debug_async(time=None):
     from model.registry import PlotTask
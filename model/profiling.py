@@ -0,0 +1,159 @@
+"""Timing of plot stages in model plot tasks.
+
+`Plot` methods drawing data or the map and `Session.get` report their wall
+time to the profiler here. `batch_plot` writes one record per region to a
+daily JSON lines file, which the report command summarizes:
+
+    python -m model.profiling [-d YYYYMMDD] [-b code|region|tick]
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+
+from tools.metplot.plotplus import profiled, set_profiler
+
+logger = logging.getLogger(__name__)
+
+
+STAGES = ('get', 'setmap', 'draw', 'contour', 'contourf', 'barbs', 'save')
+
+
+class _Stage:
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.outermost = False
+
+    def __enter__(self):
+        # Stages run inside another stage (e.g. colorbar contour inside
+        # contourf) are counted in the outer one only.
+        if self.profiler.active is None:
+            self.outermost = True
+            self.profiler.active = self.name
+            self.tic = time.perf_counter()
+
+    def __exit__(self, *exc):
+        if self.outermost:
+            self.profiler.durations[self.name] += time.perf_counter() - self.tic
+            self.profiler.active = None
+
+
+class RenderProfiler:
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.active = None
+        self.tic = None
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def start(self):
+        self.durations.clear()
+        self.active = None
+        self.tic = time.perf_counter()
+
+    def record(self, model, code, region, tick, failed=False):
+        """Write durations since `start` as one line of today's metrics file."""
+        if not getattr(settings, 'MODEL_PROFILING', True):
+            return
+        total = time.perf_counter() - self.tic
+        stages = OrderedDict((k, round(v, 4)) for k, v in self.durations.items())
+        stages['other'] = round(total - sum(self.durations.values()), 4)
+        entry = {
+            'time': datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S'),
+            'model': model,
+            'code': code,
+            'region': region,
+            'tick': tick,
+            'total': round(total, 4),
+            'failed': failed,
+            'stages': stages
+        }
+        try:
+            path = metrics_path(datetime.date.today())
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+        except OSError:
+            logger.exception('Failed to write plot metrics.')
+
+
+def metrics_path(date):
+    return os.path.join(settings.TMP_ROOT, 'profile', 'model',
+        date.strftime('%Y%m%d') + '.jsonl')
+
+def load_records(date):
+    path = metrics_path(date)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def summarize(records, by='code'):
+    """Mean seconds of each stage and in total, grouped by given field."""
+    groups = OrderedDict()
+    for record in sorted(records, key=lambda r: str(r[by])):
+        group = groups.setdefault(record[by], {'count': 0, 'failed': 0,
+            'total': 0., 'stages': defaultdict(float)})
+        group['count'] += 1
+        group['failed'] += record['failed']
+        group['total'] += record['total']
+        for stage, seconds in record['stages'].items():
+            group['stages'][stage] += seconds
+    summary = OrderedDict()
+    for key, group in groups.items():
+        count = group['count']
+        summary[key] = {
+            'count': count,
+            'failed': group['failed'],
+            'total': group['total'] / count,
+            'stages': {k: v / count for k, v in group['stages'].items()}
+        }
+    return summary
+
+def format_summary(summary, by='code'):
+    columns = list(STAGES) + ['other']
+    lines = ['{:<16}{:>6}{:>7}{:>8}'.format(by, 'count', 'failed', 'total') + \
+        ''.join('{:>9}'.format(c) for c in columns)]
+    for key, item in summary.items():
+        lines.append('{:<16}{:>6}{:>7}{:>8.2f}'.format(str(key), item['count'],
+            item['failed'], item['total']) + ''.join('{:>9.3f}'.format(
+            item['stages'].get(c, 0.)) for c in columns))
+    return '\n'.join(lines)
+
+
+profiler = RenderProfiler()
+set_profiler(profiler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Summarize stage timings of '
+        'model plot tasks, in mean seconds per region.')
+    parser.add_argument('-d', '--date', help='YYYYMMDD, default today')
+    parser.add_argument('-b', '--by', default='code', choices=('code', 'region',
+        'tick'))
+    args = parser.parse_args(argv)
+    if args.date:
+        date = datetime.datetime.strptime(args.date, '%Y%m%d').date()
+    else:
+        date = datetime.date.today()
+    records = load_records(date)
+    if not records:
+        print('No records for {}.'.format(date.strftime('%Y%m%d')))
+        return
+    print(format_summary(summarize(records, by=args.by), by=args.by))
+
+
+if __name__ == '__main__':
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'windygram.settings')
+    django.setup()
+    main()
@@ -30,10 +30,6 @@ class PlotTask:
         self.category = category
         self.name = name
         self.plevel = plevel
-        self.requested_ticks = []
-
-    def validate(self):
-        return False
 
     def to_json(self):
         json = {
@@ -50,7 +46,7 @@ class PlotTask:
 
     @classmethod
     def from_json(cls, json):
-        instance = cls(json['model'], json['params'], regions=json['params'],
+        instance = cls(json['model'], json['params'], regions=json['regions'],
             times=json['times'], priority=json['priority'], code=json['code'],
             georange=json['georange'])
         instance.plotfunc = import_string(json['_func_path'])
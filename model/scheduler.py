@@ -0,0 +1,154 @@
+"""Dependency-aware priority scheduling of model plots.
+
+Each (plot code, tick) is a node depending on the decoded fields it reads,
+including time-shifted params like `850:t/-24` which depend on another tick.
+The kicker reports every field as it lands, and nodes whose inputs are all
+there are handed back at once, most urgent first. Urgency comes from how
+often users look at a product (counted in `model.views`) and its lead time.
+"""
+import datetime
+from collections import defaultdict
+
+from django.core.cache import cache
+
+from model.param import Param
+from model.registry import registry_center
+
+VIEW_KEY = 'MODEL_VIEWS_{}_{}_{}'
+VIEW_DAYS = 7
+NEAR_TERM_TICKS = 72
+PRIORITY_TOP = 0
+
+
+def view_name(code, region=None):
+    """Name views are counted under, `CODE` or `CODE_regionpkey`. Region may
+    be given by name as users pick it or by map area pkey."""
+    if not region:
+        return code.upper()
+    return '{}_{}'.format(code.upper(),
+        region.replace(' ', '_').replace('&', '').lower())
+
+def record_view(model, code, region=None):
+    """Count a view of a product, by code and by code and region."""
+    date = datetime.datetime.utcnow().strftime('%Y%m%d')
+    timeout = (VIEW_DAYS + 1) * 86400
+    names = [view_name(code)]
+    if region:
+        names.append(view_name(code, region))
+    for name in names:
+        key = VIEW_KEY.format(model, name, date)
+        if cache.add(key, 1, timeout):
+            continue
+        try:
+            cache.incr(key)
+        except ValueError:
+            # expired in between
+            cache.set(key, 1, timeout)
+
+def get_views(model, names):
+    """Views of given codes (or `CODE_region` names) in the last days."""
+    today = datetime.datetime.utcnow()
+    dates = [(today - datetime.timedelta(days=i)).strftime('%Y%m%d')
+        for i in range(VIEW_DAYS)]
+    keys = {VIEW_KEY.format(model, name, date): name for name in names
+        for date in dates}
+    views = dict.fromkeys(names, 0)
+    for key, value in cache.get_many(list(keys)).items():
+        views[keys[key]] += value
+    return views
+
+
+class PlotNode:
+
+    def __init__(self, task, tick, deps, priority):
+        self.task = task
+        self.tick = tick
+        self.missing = set(deps)
+        self.priority = priority
+        self.dispatched = False
+
+    def __repr__(self):
+        return '<PlotNode {} +{}h P{}>'.format(self.task.code, self.tick,
+            self.priority)
+
+
+class PlotScheduler:
+
+    def __init__(self, model, ticks, codes=None):
+        self.model = model
+        self.ticks = list(ticks)
+        self.tasks = [t for t in registry_center.all_tasks if t.model == model \
+            and (codes is None or t.code in codes)]
+        views = get_views(model, [view_name(t.code) for t in self.tasks])
+        viewed = sorted((v, t.code) for t in self.tasks
+            for v in [views[view_name(t.code)]] if v > 0)
+        viewed.reverse()
+        self.ranks = {code: i for i, (_, code) in enumerate(viewed)}
+        self.dependents = defaultdict(list)
+        self.nodes = []
+        for tick in self.ticks:
+            for task in self.tasks:
+                deps = self.dependencies(task, tick)
+                node = PlotNode(task, tick, deps, self.priority(task, tick))
+                self.nodes.append(node)
+                for dep in deps:
+                    self.dependents[dep].append(node)
+
+    def dependencies(self, task, tick):
+        """(tick, purekey) of fields read by the task. Shifted ticks which are
+        not in this run are left out, `Session.get` gives None for them."""
+        deps = set()
+        for paramkey in task.params:
+            param = Param.from_str(paramkey)
+            dep_tick = tick if param.time is None else tick + int(param.time)
+            if dep_tick in self.ticks:
+                deps.add((dep_tick, param.purekey))
+        return deps
+
+    def priority(self, task, tick):
+        """Celery priority, lower runs earlier. Start from the registered
+        priority, promote the most viewed quarter of products by two levels,
+        the second quarter by one, and near-term ticks by one more."""
+        bonus = 0
+        rank = self.ranks.get(task.code)
+        if rank is not None:
+            quarter = len(self.tasks) / 4
+            if rank < quarter:
+                bonus += 2
+            elif rank < quarter * 2:
+                bonus += 1
+        if tick <= NEAR_TERM_TICKS:
+            bonus += 1
+        return max(PRIORITY_TOP, task.priority - bonus)
+
+    def land(self, tick, paramkey):
+        """Mark a field as available and return nodes which became ready."""
+        ready = []
+        for node in self.dependents.get((tick, Param.to_purekey(paramkey)), []):
+            node.missing.discard((tick, Param.to_purekey(paramkey)))
+            if not node.missing and not node.dispatched:
+                node.dispatched = True
+                ready.append(node)
+        ready.sort(key=lambda n: (n.priority, n.tick))
+        return ready
+
+    def order_params(self, tick, paramkeys):
+        """Sort params so that fields wanted by urgent plots are fetched first."""
+        def urgency(paramkey):
+            nodes = self.dependents.get((tick, paramkey), [])
+            return min([n.priority for n in nodes if not n.dispatched] or [99])
+        return sorted(paramkeys, key=urgency)
+
+    def order_regions(self, code, regions):
+        """Sort map areas of a code by views, most viewed are plotted first."""
+        names = [view_name(code, r.pkey) for r in regions]
+        views = get_views(self.model, names)
+        return [r for _, r in sorted(zip(names, regions),
+            key=lambda item: -views[item[0]])]
+
+    def pending(self):
+        return [n for n in self.nodes if not n.dispatched]
+
+    def count(self, tick):
+        """Number of codes plotted at a tick."""
+        return sum(1 for n in self.nodes if n.tick == tick)
@@ -1,12 +1,30 @@
 import datetime
 
 from django.core.cache import cache
+from django_redis import get_redis_connection
 
 from model.models import PlotModel
-from model.kicker import models_runtime
 from tools.cache import Key
 
 
+models_runtime = {'ecmwf': list(range(0, 241, 24))}
+MODEL_HISTORY_RUNS = 5
+STATUS_TIMEOUT = 30 * Key.DAY
+
+# Progress is kept in plain redis structures which are updated atomically,
+# so workers finishing at the same time never overwrite each other.
+# Runs of a model, sorted set of basetime strings scored by basetime.
+RUNS_KEY = 'MODEL_RUNS_{model}'
+# Finished ticks of a code and region in a run.
+TICKS_KEY = 'MODEL_TICKS_{model}_{region}_{code}_{time}'
+# Finished codes of a region at a tick of a run.
+CODES_KEY = 'MODEL_CODES_{model}_{region}_{time}_{tick}'
+# Codes whose all regions are done at a tick of a run, and ticks of a run
+# whose all codes are done.
+TICK_CODES_KEY = 'MODEL_TICK_CODES_{model}_{time}_{tick}'
+FINISHED_TICKS_KEY = 'MODEL_FINISHED_TICKS_{model}_{time}'
+
+
 def register_plot_model():
     from model.registry import registry_center
     PlotModel.objects.all().delete()
@@ -47,8 +65,79 @@ def select_name_and_code(model, region, plevel):
         cache.set(id_key, codes, 30 * Key.DAY)
     return codes
 
+def label_finished(model, region, code, basetime, tick=None):
+    """Mark a plot finished. If tick is None, only the run is registered."""
+    time = basetime.strftime('%Y%m%d%H')
+    runs_key = RUNS_KEY.format(model=model)
+    pipe = get_redis_connection('default').pipeline()
+    pipe.zadd(runs_key, {time: int(time)})
+    pipe.zremrangebyrank(runs_key, 0, -MODEL_HISTORY_RUNS - 1)
+    if tick is not None:
+        ticks_key = TICKS_KEY.format(model=model, region=region, code=code.upper(),
+            time=time)
+        codes_key = CODES_KEY.format(model=model, region=region, time=time,
+            tick=tick)
+        pipe.sadd(ticks_key, tick)
+        pipe.expire(ticks_key, STATUS_TIMEOUT)
+        pipe.sadd(codes_key, code.upper())
+        pipe.expire(codes_key, STATUS_TIMEOUT)
+    pipe.execute()
+
+def label_tick_codes(model, time, tick, codes, expected):
+    """Mark codes done at tick of run `time` (YYYYMMDDHH). Once `expected`
+    codes are done the tick is marked finished, returns whether it is."""
+    codes_key = TICK_CODES_KEY.format(model=model, time=time, tick=tick)
+    ticks_key = FINISHED_TICKS_KEY.format(model=model, time=time)
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline()
+    pipe.sadd(codes_key, *[code.upper() for code in codes])
+    pipe.expire(codes_key, STATUS_TIMEOUT)
+    pipe.scard(codes_key)
+    done = pipe.execute()[-1]
+    if done < expected:
+        return False
+    pipe = conn.pipeline()
+    pipe.sadd(ticks_key, tick)
+    pipe.expire(ticks_key, STATUS_TIMEOUT)
+    pipe.execute()
+    return True
+
+def get_finished_ticks(model, time):
+    conn = get_redis_connection('default')
+    ticks = conn.smembers(FINISHED_TICKS_KEY.format(model=model, time=time))
+    return sorted(int(t) for t in ticks)
+
+def get_runs(model):
+    conn = get_redis_connection('default')
+    runs = conn.zrevrange(RUNS_KEY.format(model=model), 0, MODEL_HISTORY_RUNS - 1)
+    return [r.decode() for r in runs]
+
 def get_update_status(model, region, code):
     region = region.replace(' ', '_').replace('&', '').lower()
-    key = 'STATUS_{}_{}_{}'.format(model, region, code.upper())
-    status = cache.get(key) or models_runtime.get(model, [])
-    return status
+    runtime = models_runtime.get(model, [])
+    runs = get_runs(model)
+    pipe = get_redis_connection('default').pipeline(transaction=False)
+    for time in runs:
+        pipe.smembers(TICKS_KEY.format(model=model, region=region,
+            code=code.upper(), time=time))
+    status = []
+    for i, (time, members) in enumerate(zip(runs, pipe.execute())):
+        ticks = sorted(int(t) for t in members)
+        if not ticks and i > 0:
+            # Code wasn't plotted in this old run at all.
+            continue
+        status.append({
+            'time': time,
+            'ticks': ticks,
+            'pending': [r for r in runtime if r not in ticks],
+            'updating': bool(runtime) and max(runtime) not in ticks
+        })
+    return status or runtime
+
+def get_finished_codes(model, region, time, tick):
+    """Codes of a region finished at given tick of run `time` (YYYYMMDDHH)."""
+    region = region.replace(' ', '_').replace('&', '').lower()
+    conn = get_redis_connection('default')
+    members = conn.smembers(CODES_KEY.format(model=model, region=region,
+        time=time, tick=tick))
+    return sorted(m.decode() for m in members)
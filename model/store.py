@@ -0,0 +1,80 @@
+"""Decoded model fields shared by all plot tasks of a run.
+
+Every GRIB message is decoded only once, in the kicker, right after it is
+downloaded. The values are saved as plain `.npy` files next to the GRIB
+files, and plot tasks memory-map them, so dozens of regional plots of the
+same tick share one decoded copy in the page cache instead of running cfgrib
+again in each worker.
+"""
+import logging
+import os
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+MAX_MAPPED_FIELDS = 64
+
+
+class FieldStore:
+
+    def __init__(self, model, basetime):
+        self.model = model
+        self.basetime = basetime
+        self.root = os.path.join(settings.TMP_ROOT, 'model',
+            basetime.strftime('%Y%m%d%H'), model)
+
+    def path(self, paramkey, tick):
+        return os.path.join(self.root, '{}_{}.npy'.format(tick,
+            paramkey.replace(':', '-')))
+
+    def exists(self, paramkey, tick):
+        return os.path.exists(self.path(paramkey, tick))
+
+    def mtime(self, paramkey, tick):
+        """Modification time of field in ns, None if it isn't there."""
+        try:
+            return os.stat(self.path(paramkey, tick)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def put(self, paramkey, tick, data):
+        """Save decoded values. The file is renamed into place so that readers
+        never see a partially written field."""
+        path = self.path(paramkey, tick)
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(data, dtype=np.float32))
+        os.replace(tmp_path, path)
+        _mapped_fields_.pop(path, None)
+        return path
+
+    def put_dataset(self, paramkey, tick, ds):
+        default_key = list(ds.data_vars)[0]
+        return self.put(paramkey, tick, ds.get(default_key).values)
+
+    def get(self, paramkey, tick):
+        """Return read-only memory-mapped field, slicing it gives views."""
+        return load_field(self.path(paramkey, tick))
+
+
+_mapped_fields_ = OrderedDict()
+
+def load_field(path):
+    if path in _mapped_fields_:
+        _mapped_fields_.move_to_end(path)
+        return _mapped_fields_[path]
+    # Plain ndarray view of the map, arithmetic on np.memmap subclass would
+    # give confusing memmap results which are not backed by any file.
+    data = np.load(path, mmap_mode='r').view(np.ndarray)
+    _mapped_fields_[path] = data
+    if len(_mapped_fields_) > MAX_MAPPED_FIELDS:
+        _mapped_fields_.popitem(last=False)
+    return data
+
+def release_fields():
+    _mapped_fields_.clear()
@@ -1,8 +1,8 @@
 import numpy as np
 
+from model.climate import get_climatology
 from model.registry import register
 from tools.metplot.plotplus import Plot
-from tools.utils import get_climatological_data
 
 scope = __name__
 
@@ -34,7 +34,7 @@ def plot_gpt(session):
     p.title('ECMWF 850mb Temperature (shaded), Wind (vector) & '
         '500mb Geopotential Height (contour)')
     p.timestamp(session.basetime, session.fcsthour)
-    p.save(session.target_path)
+    p.save(session.target_path, layout=session.code)
     p.clear()
 
 @register(model='ecmwf', params=('500:h', 'msl:p'), code='GHP',
@@ -57,7 +57,7 @@ def plot_ghw(session):
     p.maxminnote(mslp, type='min', fmt='{:.1f}', unit='hPa', name='MSLP')
     p.title('ECMWF 500mb Geopotential Height (shaded) & MSLP (contour, extrema)')
     p.timestamp(session.basetime, session.fcsthour)
-    p.save(session.target_path)
+    p.save(session.target_path, layout=session.code)
     p.clear()
 
 @register(model='ecmwf', params=('850:u', '850:v', 'msl:p'), code='WNP',
@@ -67,7 +67,7 @@ def plot_wnp(session):
     u = session.get('850:u') * 1.94
     v = session.get('850:v') * 1.94
     mslp = session.get('msl:p') / 100
-    wind = np.hypot(u, v)
+    wind = session.derive('850:wind') * 1.94
     p = Plot(aspect='cos')
     p.usemapset(session.get_mapset())
     p.setxy(session.georange, session.resolution)
@@ -86,7 +86,7 @@ def plot_wnp(session):
     p.maxminnote(wind, type='max', fmt='{:.1f}', unit='kt', name='Wind')
     p.title('ECMWF 850mb Wind (shaded, barbs) & MSLP (contour, extrema)')
     p.timestamp(session.basetime, session.fcsthour)
-    p.save(session.target_path)
+    p.save(session.target_path, layout=session.code)
     p.clear()
 
 @register(model='ecmwf', params=('500:h',), code='GPA', category='upper air',
@@ -95,7 +95,7 @@ def plot_gpa(session):
     import datetime
     nowtime = session.basetime + datetime.timedelta(hours=session.fcsthour)
     geopo = session.get('500:h')
-    clim_data = get_climatological_data('geopo', 'z', nowtime, session.georange,
+    clim_data = get_climatology('geopo', 'z', nowtime, session.georange,
         step=2) / 9.80665
     anomaly = geopo - clim_data
     p = Plot()
@@ -108,14 +108,13 @@ def plot_gpa(session):
     p.title('ECMWF 500mb Geopotential Height (contour) & Anomaly (shaded, based on '
         'ERA5 1979-2018 Climatology)')
     p.timestamp(session.basetime, session.fcsthour)
-    p.save(session.target_path)
+    p.save(session.target_path, layout=session.code)
     p.clear()
 
 @register(model='ecmwf', params=('850:u', '850:v', 'msl:p'), code='VOP',
     category='lower air', name='850hPa Vorticity', regions=['Western Pacific',
     'China'], scope=scope)
 def plot_vop(session):
-    from metpy.calc import lat_lon_grid_deltas, vorticity
     u = session.get('850:u')
     v = session.get('850:v')
     mslp = session.get('msl:p') / 100
@@ -125,8 +124,7 @@ def plot_vop(session):
     p.draw('coastline country parameri')
     if 'China' in session.region.key:
         p.draw('province')
-    dx, dy = lat_lon_grid_deltas(p.xx, p.yy)
-    vort = vorticity(u, v, dx, dy) * 1e5
+    vort = session.derive('850:vort') * 1e5
     p.contourf(vort, gpfcmap='vort', cbar=True)
     p.maxminfilter(mslp, type='min', marktext=True, vmax=1008, window=30,
         marktextdict=dict(mark='L', color='r'), stroke=True, zorder=5)
@@ -137,7 +135,7 @@ def plot_vop(session):
     p.title('ECMWF 850mb Relative Vorticity (shaded), 850mb Wind (barbs) & '
         'MSLP (extrema)')
     p.timestamp(session.basetime, session.fcsthour)
-    p.save(session.target_path)
+    p.save(session.target_path, layout=session.code)
     p.clear()
 
 @register(model='ecmwf', params=('850:t',), code='TMA', category='upper air',
@@ -146,8 +144,8 @@ def plot_tma(session):
     import datetime
     nowtime = session.basetime + datetime.timedelta(hours=session.fcsthour)
     temp = session.get('850:t')
-    clim_data = get_climatological_data('temp850', 't', nowtime,
-        session.georange, step=2)
+    clim_data = get_climatology('temp850', 't', nowtime, session.georange,
+        step=2)
     anomaly = temp - clim_data
     if session.region.kwargs.get('proj', None) is None:
         # PlateCarree projection
@@ -164,5 +162,5 @@ def plot_tma(session):
     p.title('ECMWF 850mb Temperature Anomaly (shaded, based on '
         'ERA5 1979-2018 Climatology)')
     p.timestamp(session.basetime, session.fcsthour)
-    p.save(session.target_path)
+    p.save(session.target_path, layout=session.code)
     p.clear()
@@ -0,0 +1,283 @@
+import datetime
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from model.derived import get_derived
+from model.grid import Grid, get_window
+from model.history import RunHistory, pack, unpack
+from model.kicker import (ECMWF_MAX_INFLIGHT_TICKS, DatasetCache, ECMWFKicker,
+                          ModelException, Session)
+from model.scheduler import PlotScheduler, record_view
+from model.store import FieldStore
+
+LOCMEM_CACHE = {'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RegionOrderTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_viewed_region_is_plotted_first(self):
+        scheduler = PlotScheduler('test', [])
+        regions = [SimpleNamespace(pkey='china'),
+            SimpleNamespace(pkey='east_asia')]
+        self.assertEqual(scheduler.order_regions('t2m', regions), regions)
+        # Views come in with the region name as the user picked it.
+        record_view('test', 't2m', 'East Asia')
+        self.assertEqual(scheduler.order_regions('t2m', regions),
+            regions[::-1])
+
+
+class WindowTest(SimpleTestCase):
+
+    def setUp(self):
+        self.grid = Grid(0.5)
+        lats = 90 - 0.5 * np.arange(self.grid.ny)
+        lons = 0.5 * np.arange(self.grid.nx)
+        self.lons, self.lats = np.meshgrid(lons, lats)
+
+    def check(self, georange, step=1):
+        """Apply window of georange to the longitudes and latitudes of the grid
+        and compare them with the georange."""
+        latmin, latmax, lonmin, lonmax = georange
+        window = get_window(self.grid, georange, step=step)
+        lons = window.apply(self.lons)
+        lats = window.apply(self.lats)
+        self.assertEqual(lons.shape, window.shape)
+        if lonmax < lonmin:
+            lonmax += 360
+        expected = np.arange(lonmin, lonmax + 0.25, 0.5 * step) % 360
+        np.testing.assert_array_equal(lons[0], expected)
+        expected = np.arange(latmin, latmax + 0.25, 0.5 * step)
+        np.testing.assert_array_equal(lats[:, 0], expected)
+        return lons
+
+    def test_window_is_a_view(self):
+        lons = self.check((10, 50, 70, 140))
+        self.assertTrue(np.shares_memory(lons, self.lons))
+
+    def test_negative_longitudes(self):
+        # Eastern Pacific.
+        lons = self.check((0, 45, -175, -85))
+        self.assertTrue(np.shares_memory(lons, self.lons))
+        self.check((0, 45, -175, -85), step=2)
+
+    def test_window_across_seam_is_a_copy(self):
+        for georange in ((0, 10, 350, 10), (-10, 10, -10, 10)):
+            lons = self.check(georange)
+            self.assertFalse(np.shares_memory(lons, self.lons))
+        self.check((0, 10, 350, 10), step=2)
+
+
+class PackingTest(SimpleTestCase):
+
+    def test_error_within_half_a_step(self):
+        rng = np.random.default_rng(0)
+        data = rng.uniform(200, 320, size=(181, 360)).astype(np.float32)
+        packed, scale, offset = pack(data)
+        self.assertEqual(packed.dtype, np.int16)
+        error = np.abs(unpack(packed, scale, offset) - data)
+        # Half a packing step, plus rounding of float32 arithmetic.
+        self.assertLessEqual(error.max(), scale / 2 + np.spacing(np.float32(320)))
+        self.assertLess(scale, 120 / 65000)
+
+    def test_nan_is_filled(self):
+        data = np.array([[np.nan, 1.], [2., np.inf]])
+        result = unpack(*pack(data))
+        np.testing.assert_array_equal(np.isnan(result), [[True, False],
+            [False, True]])
+        np.testing.assert_allclose(result[0, 1], 1, atol=1e-4)
+        self.assertTrue(np.isnan(unpack(*pack(np.full((2, 2), np.nan)))).all())
+        # A constant field, without any range to pack over.
+        np.testing.assert_array_equal(unpack(*pack(np.full((2, 2), 5.))), 5.)
+
+
+@override_settings(TMP_ROOT=tempfile.mkdtemp())
+class RunHistoryTest(SimpleTestCase):
+
+    def test_latest_runs_are_kept(self):
+        history = RunHistory('test', runs=2)
+        field = np.arange(12, dtype=np.float32).reshape(3, 4)
+        basetimes = [datetime.datetime(2019, 7, 19, h) for h in (0, 12)] + \
+            [datetime.datetime(2019, 7, 20, 0)]
+        for i, basetime in enumerate(basetimes):
+            history.put(basetime, '850:t', 0, field + i, ticks=[0, 24])
+        self.assertEqual(history.list_runs(), basetimes[:0:-1])
+        self.assertIsNone(history.get(basetimes[0], '850:t', 0))
+        np.testing.assert_allclose(history.get(basetimes[2], '850:t', 0),
+            field + 2, atol=1e-3)
+        # Allocated but not written yet, and not a tick of the run.
+        self.assertIsNone(history.get(basetimes[2], '850:t', 24))
+        self.assertIsNone(history.get(basetimes[2], '850:t', 48))
+        history.put(basetimes[1], '850:t', 24, field, ticks=[0, 24])
+        valid = history.get_valid('850:t', basetimes[2])
+        self.assertEqual([(b, t) for b, t, _ in valid], [(basetimes[2], 0)])
+        valid = history.get_valid('850:t', basetimes[1] + datetime.timedelta(
+            hours=24))
+        self.assertEqual([(b, t) for b, t, _ in valid], [(basetimes[1], 24)])
+
+
+@override_settings(TMP_ROOT=tempfile.mkdtemp())
+class DerivedFieldTest(SimpleTestCase):
+
+    def test_recomputed_after_source_is_decoded_again(self):
+        store = FieldStore('test', datetime.datetime(2019, 7, 19, 0))
+        grid = Grid(0.5)
+        ones = np.ones((3, 4))
+        store.put('850:u', 0, 3 * ones)
+        store.put('850:v', 0, 4 * ones)
+        np.testing.assert_array_equal(get_derived(store, grid, '850:wind', 0),
+            5 * ones)
+        path = store.put('850:u', 0, 0 * ones)
+        # A later decode, even within the resolution of file times.
+        stamp = store.mtime('850:wind', 0) + 10 ** 9
+        os.utime(path, ns=(stamp, stamp))
+        np.testing.assert_array_equal(get_derived(store, grid, '850:wind', 0),
+            4 * ones)
+
+
+@override_settings(TMP_ROOT=tempfile.mkdtemp())
+class SessionFingerprintTest(SimpleTestCase):
+
+    def test_derived_param_changes_with_its_sources(self):
+        basetime = datetime.datetime(2019, 7, 19, 0)
+        store = FieldStore('ecmwf', basetime)
+        ones = np.ones((3, 4))
+        for key in ('850:u', '850:v', '850:wind'):
+            store.put(key, 0, ones)
+        session = Session(model='ecmwf', basetime=basetime, fcsthour=0,
+            params=['850:wind'], code='WND', region=SimpleNamespace(
+            key='Asia', path=store.path('850:wind', 0)))
+        task = SimpleNamespace(plotfunc=lambda session: None)
+        before = session.fingerprint(task)
+        path = store.put('850:u', 0, 2 * ones)
+        stamp = store.mtime('850:wind', 0) + 10 ** 9
+        os.utime(path, ns=(stamp, stamp))
+        self.assertNotEqual(session.fingerprint(task), before)
+
+    def test_derive_needs_sources_in_params(self):
+        session = Session(model='ecmwf', params=['850:u', 'msl:p'])
+        with self.assertRaises(ValueError):
+            session.derive('850:wind')
+
+
+class ListedRunKicker(ECMWFKicker):
+    """Kicker of a run whose files are all on the server already, downloads
+    just mark files fetched."""
+
+    def establish(self):
+        self.params = ['msl:p', '850:t']
+        self.pending = list(self.clocks)
+        self.watcher = SimpleNamespace(poll=set, listed={self.param_to_filename(
+            p, t) for p in self.params for t in self.pending})
+        self.pool = SimpleNamespace(ping=lambda: None)
+        self.scheduler = SimpleNamespace(order_params=lambda tick, params: params)
+        self.fetched = set()
+        self.requested = set()
+        self.fetch_lock = threading.Lock()
+        self.inflight = {}
+        self.downloads = ThreadPoolExecutor(max_workers=ECMWF_MAX_INFLIGHT_TICKS)
+
+    def download_tick(self, tick, params):
+        with self.fetch_lock:
+            self.fetched.update((tick, p) for p in params)
+
+    def destroy(self):
+        self.downloads.shutdown(wait=True)
+
+
+class KickerPollTest(SimpleTestCase):
+
+    @mock.patch('model.kicker.time.sleep')
+    def test_late_run_with_all_files_listed_finishes(self, sleep):
+        kicker = ListedRunKicker()
+        kicker.kick(time='2019071900')
+        self.assertEqual(kicker.pending, [])
+        self.assertEqual(len(kicker.fetched), 22)
+
+    def test_late_run_gives_up_when_nothing_appears(self):
+        kicker = ListedRunKicker()
+        kicker.set_time(datetime.datetime(2019, 7, 19, 0))
+        kicker.establish()
+        kicker.watcher.listed.clear()
+        kicker.tick = 0
+        self.assertEqual(kicker.poll_interval(), 180)
+        kicker.failed = 1
+        with self.assertRaises(ModelException):
+            kicker.poll_interval()
+        kicker.destroy()
+
+
+class FakeDataset:
+
+    nbytes = 100
+
+    def __init__(self, path):
+        with open(path) as f:
+            self.content = f.read()
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class DatasetCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = DatasetCache(max_bytes=250)
+        self.cache.open = lambda path, filter_by_keys=None: FakeDataset(path)
+        self.root = tempfile.mkdtemp()
+
+    def write(self, name, content):
+        path = os.path.join(self.root, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_second_open_is_reused(self):
+        path = self.write('0_850-t.grib2', 'a')
+        ds = self.cache.get(path)
+        self.assertIs(self.cache.get(path), ds)
+        self.assertIsNot(self.cache.get(path, {'shortName': 't'}), ds)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    def test_changed_file_is_opened_again(self):
+        path = self.write('0_850-t.grib2', 'a')
+        ds = self.cache.get(path)
+        stamp = os.stat(path).st_mtime_ns
+        # Downloaded again within the resolution of file times.
+        self.write('0_850-t.grib2', 'bb')
+        os.utime(path, ns=(stamp, stamp))
+        self.assertEqual(self.cache.get(path).content, 'bb')
+        self.assertTrue(ds.closed)
+        # Downloaded again with the same size.
+        ds = self.cache.get(path)
+        self.write('0_850-t.grib2', 'cc')
+        stamp += 10 ** 9
+        os.utime(path, ns=(stamp, stamp))
+        self.assertEqual(self.cache.get(path).content, 'cc')
+        self.assertTrue(ds.closed)
+        self.assertEqual(self.cache.stats()['entries'], 1)
+        self.assertEqual(self.cache.stats()['bytes'], 100)
+
+    def test_least_recently_used_is_evicted(self):
+        paths = [self.write('{}_850-t.grib2'.format(i), str(i)) for i in range(3)]
+        first = self.cache.get(paths[0])
+        second = self.cache.get(paths[1])
+        self.cache.get(paths[0])
+        self.cache.get(paths[2])
+        self.assertTrue(second.closed)
+        self.assertFalse(first.closed)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
@@ -1,7 +1,9 @@
 from braces.views import JsonRequestResponseMixin
 from django.views.generic.base import View
 
-from model.status import get_update_status, select_name_and_code
+from model.scheduler import record_view
+from model.status import (get_finished_codes, get_finished_ticks, get_runs,
+                          get_update_status, select_name_and_code)
 from tools.cache import Key
 
 
@@ -36,5 +38,25 @@ class PlotStatusView(JsonRequestResponseMixin, View):
         region = self.request_json['region']
         code = self.request_json['code']
         status = get_update_status(model, region, code)
+        record_view(model, code, region)
         return self.render_json_response(status)
 
+
+
+class FinishedCodeListView(JsonRequestResponseMixin, View):
+
+    def post(self, request, *args, **kwargs):
+        model = self.request_json['model']
+        region = self.request_json['region']
+        tick = self.request_json['tick']
+        time = self.request_json.get('time')
+        if time is None:
+            runs = get_runs(model)
+            if not runs:
+                return self.render_json_response({'time': None, 'codes': [],
+                    'ticks': []})
+            time = runs[0]
+        codes = get_finished_codes(model, region, time, tick)
+        ticks = get_finished_ticks(model, time)
+        return self.render_json_response({'time': time, 'codes': codes,
+            'ticks': ticks})
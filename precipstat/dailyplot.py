@@ -7,6 +7,8 @@ import matplotlib.pyplot as plt
 import matplotlib.patches as mpatch
 from mpl_toolkits.axes_grid1.anchored_artists import AnchoredDrawingArea
 
+from tools.metplot.figpool import acquire_figure, release_figure
+
 fontpath = os.path.join(os.path.dirname(__file__), 'source.ttf')
 source_font = mfm.FontProperties(fname=fontpath, size=6)
 matplotlib.rc('font', family='HelveticaNeue')
@@ -27,7 +29,7 @@ GREEN = '#487530'
 class DailyPlot:
 
     def __init__(self):
-        self.fig = plt.figure(figsize=(4.5,3))
+        self.fig = acquire_figure((4.5, 3))
         self.ax = plt.axes([0, 0, 1, 1])
         self.dpi = 200
         plt.xlim([0, 1])
@@ -217,3 +219,4 @@ class DailyPlot:
         self.ax.axis('off')
         #self.fig.tight_layout(pad=0)
         self.fig.savefig(target, dpi=self.dpi, edgecolor='w')
+        release_figure(self.fig)
@@ -26,6 +26,7 @@ from django.db.models import Max, Sum
 from precipstat.newbot import RichText, TybbsBot
 from precipstat.models import DailyStat
 from precipstat.pstat import get_mean_value, get_month_percent
+from tools.metplot.figpool import acquire_figure, release_figure
 
 logger = logging.getLogger('precipstat.monthlyrepo')
 DEBUG = False
@@ -148,7 +149,7 @@ class MonthlyPlot:
 
     def __init__(self):
         self.figsize = (4.8, 7.5)
-        self.fig = plt.figure(figsize=self.figsize)
+        self.fig = acquire_figure(self.figsize)
         self.aspect = self.figsize[1] / self.figsize[0]
         self.ax = plt.axes([0, 0, 1, 1])
         self.dpi = 200
@@ -299,6 +300,7 @@ class MonthlyPlot:
         self.ax.axis('off')
         #self.fig.tight_layout(pad=0)
         self.fig.savefig(target, dpi=self.dpi, edgecolor='w')
+        release_figure(self.fig)
 
 
 class RoundedRect:
@@ -0,0 +1,450 @@
+"""Benchmark harness for the satellite pipeline.
+
+Synthetic but format-valid HSD segment files are generated on the fly, so the
+whole decode -> navigate -> resample -> render path can be timed without live
+S3 data. Results are written as JSON and can be compared across commits:
+
+```
+python -m sate.benchmark -o before.json
+# ...hack...
+python -m sate.benchmark -o after.json --compare before.json
+```
+"""
+import argparse
+import bz2
+import datetime
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+
+import numpy as np
+import pyproj
+
+from sate.format import GEOS_HEIGHT, HimawariFormat, MutilSegmentHimawariFormat
+from sate.sateimage import SateImage
+
+logger = logging.getLogger(__name__)
+
+SYNTHETIC_TIME = datetime.datetime(2019, 8, 1, 3, 0)
+SYNTHETIC_SUBLON = 140.7
+MJD_EPOCH = datetime.datetime(1858, 11, 17)
+
+# (central wavelength in um, valid bits, gain, constant) of synthetic bands
+BAND_SPECS = {
+    1: (0.4703, 11, 0.25, -5.0),
+    3: (0.6399, 11, 0.25, -5.0),
+    8: (6.2429, 12, -0.0010, 4.35),
+    13: (10.4073, 12, -0.0036, 14.74),
+}
+VIS_CSTAR = 0.0019
+PLANCK_C = 2.99792458e8
+PLANCK_H = 6.62606957e-34
+BOLTZMANN_K = 1.3806488e-23
+
+DEFAULT_CASES = [
+    dict(name='target-b13', area='target', band=13, compress=False),
+    dict(name='target-b13-bz2', area='target', band=13, compress=True),
+    dict(name='target-b13-enh-bz2', area='target', band=13, compress=True,
+        enhance=(None, 'bd', 'rbtop')),
+    dict(name='target-b03-bz2', area='target', band=3, compress=True),
+    dict(name='fulldisk-b13', area='fulldisk', band=13, compress=False,
+        georange=(5, 35, 110, 150)),
+    dict(name='fulldisk-b13-bz2', area='fulldisk', band=13, compress=True,
+        georange=(5, 35, 110, 150)),
+]
+
+
+def get_resolution_params(band):
+    """Return (CFAC/LFAC, COFF/LOFF, full disk columns) of given band."""
+    if band in (1, 2):
+        return 40932549, 5500.5, 11000
+    elif band == 3:
+        return 81865099, 11000.5, 22000
+    return 20466275, 2750.5, 5500
+
+
+def _pack(dtype, **values):
+    block = np.zeros(1, dtype=dtype)
+    for key, value in values.items():
+        block[key] = value
+    return block.tobytes()
+
+def _spare_block(number, length, wide_length=False):
+    """Header blocks this module doesn't parse, only their length matters."""
+    if wide_length:
+        header = np.array([number], dtype='u1').tobytes() + \
+            np.array([length], dtype='<u4').tobytes()
+    else:
+        header = _pack(HimawariFormat._Header, HeaderBlockNumber=number,
+            BlockLength=length)
+    return header + b'\x00' * (length - len(header))
+
+def _mjd(time):
+    return (time - MJD_EPOCH).total_seconds() / 86400
+
+
+def synthetic_field(lines, columns, band, seed=0):
+    """A cloud-like field of brightness temperature (K) or albedo."""
+    rs = np.random.RandomState(seed)
+    y, x = np.mgrid[0:lines, 0:columns].astype(np.float32)
+    y /= lines
+    x /= columns
+    field = 0.3 * np.sin(6 * x + 3 * y) * np.cos(4 * y)
+    for _ in range(12):
+        cy, cx = rs.uniform(0, 1, 2)
+        radius = rs.uniform(0.03, 0.15)
+        field += rs.uniform(0.5, 1.2) * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / \
+            (2 * radius ** 2))
+    field += rs.normal(0, 0.03, field.shape).astype(np.float32)
+    field = (field - field.min()) / (field.max() - field.min())
+    if band <= 6:
+        return 0.05 + 0.85 * field
+    return 300. - 110. * field
+
+def field_to_counts(field, band):
+    """Invert calibration of `HimawariFormat` to get raw counts."""
+    wavelength, bits, gain, const = BAND_SPECS[band]
+    if band <= 6:
+        radiance = field / VIS_CSTAR
+    else:
+        lam = wavelength * 1e-6
+        const1 = PLANCK_H * PLANCK_C / (BOLTZMANN_K * lam)
+        const2 = 2 * PLANCK_H * PLANCK_C ** 2 * lam ** -5
+        radiance = const2 / np.expm1(const1 / field) * 1e-6
+    counts = np.round((radiance - const) / gain)
+    return np.clip(counts, 0, 2 ** bits - 1).astype('<u2')
+
+
+def make_synthetic_hsd(path, band=13, lines=None, columns=None, segno=1,
+        total_segments=1, first_lineno=1, coff=None, loff=None, compress=False,
+        time=SYNTHETIC_TIME, area='R301', seed=0):
+    """Write a synthetic HSD segment file readable by `HimawariFormat`.
+
+    All header blocks are present with realistic lengths and navigation
+    constants, only the observation itself is made up."""
+    cfac, offset, fd_columns = get_resolution_params(band)
+    columns = columns or fd_columns
+    lines = lines or fd_columns // 10
+    coff = offset if coff is None else coff
+    loff = offset if loff is None else loff
+    wavelength, bits, gain, const = BAND_SPECS[band]
+    blocks = [
+        None,
+        _pack(HimawariFormat._BLOCK_02, HeaderBlockNumber=2, BlockLength=50,
+            NumberOfBitsPerPixel=16, NumberOfColumns=columns, NumberOfLines=lines),
+        _pack(HimawariFormat._BLOCK_03, HeaderBlockNumber=3, BlockLength=127,
+            SubLon=SYNTHETIC_SUBLON, CFAC=cfac, LFAC=cfac, COFF=coff, LOFF=loff,
+            Distance=42164., EarthEquatorialRadius=6378.137,
+            EarthPolarRadius=6356.7523, EarthConst1=0.00669438444,
+            EarthConst2=0.993305616, EarthConst3=1.006739501,
+            EarthConstStd=1737122264., ResamplingTypes=4, ResamplingSize=4),
+        _spare_block(4, 139),
+    ]
+    block5 = _pack(HimawariFormat._BLOCK_05, HeaderBlockNumber=5, BlockLength=147,
+        BandNumber=band, CentralWaveLength=wavelength,
+        ValidNumberOfBitsPerPixel=bits, CountValueOfErrorPixels=65535,
+        CountValueOfPixelsOutsideScanArea=65534, Gain=gain, Constant=const)
+    if band <= 6:
+        block5 += _pack(HimawariFormat._VisibleBand, **{'c*': VIS_CSTAR})
+    else:
+        block5 += _pack(HimawariFormat._InfraredBand, c0=-0.1085, c1=1.0004,
+            c2=-5.6e-7, C0=0.1134, C1=0.9996, C2=5.6e-7, c=PLANCK_C, h=PLANCK_H,
+            k=BOLTZMANN_K)
+    blocks.append(block5)
+    blocks.append(_spare_block(6, 259))
+    blocks.append(_pack(HimawariFormat._BLOCK_07, HeaderBlockNumber=7,
+        BlockLength=47, TotalNumberOfSegments=total_segments,
+        SegmentSequenceNumber=segno, FirstLineNumber=first_lineno))
+    blocks.append(_spare_block(8, 258))
+    blocks.append(_spare_block(9, 15 + 10 * 4))
+    blocks.append(_spare_block(10, 40, wide_length=True))
+    blocks.append(_spare_block(11, 256))
+    header_length = 282 + sum(len(b) for b in blocks[1:])
+    filename = 'HS_H08_{}_B{:02d}_{}_S{:02d}{:02d}.DAT'.format(
+        time.strftime('%Y%m%d_%H%M'), band, area, segno, total_segments)
+    blocks[0] = _pack(HimawariFormat._BLOCK_01, HeaderBlockNumber=1,
+        BlockLength=282, TotalNumberOfHeaderBlocks=11, ByteOrder=0,
+        SatelliteName=b'Himawari-8', ProcessingCenterName=b'MSC',
+        ObservationArea=area[:4].encode(), ObservationTimeline=time.hour * 100,
+        ObservationStartTime=_mjd(time),
+        ObservationEndTime=_mjd(time + datetime.timedelta(seconds=150)),
+        FileCreationTime=_mjd(time + datetime.timedelta(minutes=5)),
+        TotalHeaderLength=header_length, TotalDataLength=lines * columns * 2,
+        FileFormatVersion=b'1.3', FileName=filename.encode())
+    counts = field_to_counts(synthetic_field(lines, columns, band, seed=seed), band)
+    opener = bz2.open if compress else open
+    with opener(path, 'wb') as f:
+        for block in blocks:
+            f.write(block)
+        f.write(counts.tobytes())
+    return path
+
+
+def make_target_area_file(path, band=13, center=(25, 130), compress=False,
+        time=SYNTHETIC_TIME):
+    """A 1000km x 1000km rapid scan (R301) file centered at (lat, lon)."""
+    cfac, offset, fd_columns = get_resolution_params(band)
+    size = fd_columns // 11
+    proj = pyproj.Proj(proj='geos', h=GEOS_HEIGHT, lon_0=SYNTHETIC_SUBLON,
+        ellps='WGS84', sweep='y')
+    x, y = proj(center[1], center[0])
+    column = np.rad2deg(x / GEOS_HEIGHT) * cfac * 2 ** -16 + offset
+    line = np.rad2deg(-y / GEOS_HEIGHT) * cfac * 2 ** -16 + offset
+    return make_synthetic_hsd(path, band=band, lines=size, columns=size,
+        coff=offset - (column - size / 2), loff=offset - (line - size / 2),
+        compress=compress, time=time)
+
+def make_fulldisk_files(directory, georange, band=13, compress=False,
+        time=SYNTHETIC_TIME):
+    """Full disk segment files covering given georange, along with vline/vcol
+    which `get_segno` would have given."""
+    from sate.format import get_segno
+    segs, vlines, vcols = get_segno(georange)
+    cfac, offset, fd_columns = get_resolution_params(band)
+    seg_lines = fd_columns // 10
+    suffix = '.bz2' if compress else ''
+    paths = []
+    for seg in segs:
+        path = os.path.join(directory, 'B{}_S{}{}'.format(band, seg, suffix))
+        make_synthetic_hsd(path, band=band, segno=seg, total_segments=10,
+            first_lineno=(seg - 1) * seg_lines + 1, compress=compress, time=time,
+            area='FLDK', seed=seg)
+        paths.append(path)
+    return paths, vlines, vcols
+
+
+class SyntheticSateFile:
+    """Stand-in of `SateFile` pointing to synthetic files in a work directory."""
+
+    def __init__(self, directory, area='target', band=13, enhance=None,
+            target_path=None, georange=None, vline=None, vcol=None,
+            time=SYNTHETIC_TIME):
+        self.time = time
+        self.area = area
+        self.band = band
+        self.enhance = enhance
+        self.name = 'BENCH'
+        self.storm = None
+        self.georange = georange
+        self.vline = vline
+        self.vcol = vcol
+        self.target_path = target_path
+        self.export_path = os.path.join(directory, 'export_b{}{{enh}}.png'.format(band))
+        self.latest_path = os.path.join(directory, 'latest_b{}{{enh}}.png'.format(band))
+
+
+class BenchmarkSateImage(SateImage):
+    """`SateImage` without side effects on the shared cache."""
+
+    def set_target_area_midpoint(self, georange):
+        return (georange[2] + georange[3]) / 2, (georange[0] + georange[1]) / 2
+
+    def _write_cache(self, enh_str, export_path):
+        pass
+
+
+class StageTimer:
+    """Record wall time, and optionally peak traced memory, of named stages."""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.timings = OrderedDict()
+        self.peaks = OrderedDict()
+
+    def __call__(self, stage):
+        return _Stage(self, stage)
+
+
+class _Stage:
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        if self.timer.trace_memory:
+            tracemalloc.start()
+        self.tic = time.perf_counter()
+
+    def __exit__(self, *exc):
+        toc = time.perf_counter()
+        self.timer.timings[self.name] = toc - self.tic
+        if self.timer.trace_memory:
+            self.timer.peaks[self.name] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+
+def prepare_case(case, directory):
+    band = case['band']
+    compress = case.get('compress', False)
+    if case['area'] == 'target':
+        path = os.path.join(directory, 'target_B{}{}'.format(band,
+            '.bz2' if compress else ''))
+        make_target_area_file(path, band=band, compress=compress,
+            center=case.get('center', (25, 130)))
+        return SyntheticSateFile(directory, band=band, enhance=case.get('enhance'),
+            target_path=path)
+    paths, vlines, vcols = make_fulldisk_files(directory, case['georange'],
+        band=band, compress=compress)
+    return SyntheticSateFile(directory, area='fulldisk', band=band,
+        enhance=case.get('enhance'), target_path=paths,
+        georange=case['georange'], vline=vlines, vcol=vcols)
+
+def run_pipeline(satefile, timer):
+    """Run the same steps as `SateImage.imager`, stage by stage."""
+    image = BenchmarkSateImage(satefile)
+    if satefile.area == 'target':
+        hfs = [HimawariFormat(satefile.target_path)]
+        vline = vcol = None
+    else:
+        hfs = [HimawariFormat(path) for path in satefile.target_path]
+        vline, vcol = satefile.vline, satefile.vcol
+    with timer('load'):
+        for hf in hfs:
+            hf.load()
+    with timer('extract'):
+        raw = np.concatenate([hf._extract(vline=vline, vcol=vcol) for hf in hfs])
+    with timer('calibration'):
+        data = hfs[0].calibration(raw)
+    with timer('navigate'):
+        if satefile.area == 'target':
+            lons, lats = hfs[0].get_geocoord()
+            georange = image._align_window((lats.min(), lats.max(), lons.min(),
+                lons.max()))
+        else:
+            msf = MutilSegmentHimawariFormat(satefile.target_path)
+            msf.load()
+            msf.f.close()
+            lons, lats = msf.get_geocoord(vline=vline, vcol=vcol)
+            georange = satefile.georange
+    image.georange, image.lons, image.lats, image.data = georange, lons, lats, data
+    with timer('map'):
+        image.map = image.make_map()
+    with timer('resample'):
+        extent, target_xy = image.remap_data()
+    with timer('render'):
+        image.render(extent, target_xy)
+
+def run_case(case, repeat=3, trace_memory=True):
+    with tempfile.TemporaryDirectory(prefix='satebench') as directory:
+        satefile = prepare_case(case, directory)
+        runs = []
+        for _ in range(repeat):
+            timer = StageTimer()
+            run_pipeline(satefile, timer)
+            runs.append(timer.timings)
+        peaks = {}
+        if trace_memory:
+            # Tracing slows allocation down, so peaks come from a separate run
+            timer = StageTimer(trace_memory=True)
+            run_pipeline(satefile, timer)
+            peaks = timer.peaks
+    stages = OrderedDict()
+    for stage in runs[0]:
+        values = [r[stage] for r in runs]
+        stages[stage] = {
+            'min': min(values),
+            'median': float(np.median(values)),
+            'peak_kb': peaks[stage] // 1024 if stage in peaks else None
+        }
+    total = [sum(r.values()) for r in runs]
+    return {
+        'params': {k: v for k, v in case.items() if k != 'name'},
+        'stages': stages,
+        'total': {'min': min(total), 'median': float(np.median(total))}
+    }
+
+
+def get_commit():
+    try:
+        result = subprocess.run('git rev-parse --short HEAD', shell=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return result.stdout.decode().strip() or None
+
+def run(cases=None, repeat=3, trace_memory=True):
+    cases = cases or DEFAULT_CASES
+    report = OrderedDict()
+    report['meta'] = {
+        'commit': get_commit(),
+        'time': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'repeat': repeat
+    }
+    report['cases'] = OrderedDict()
+    for case in cases:
+        logger.info('Benchmark case: {}'.format(case['name']))
+        report['cases'][case['name']] = run_case(case, repeat=repeat,
+            trace_memory=trace_memory)
+    # kilobytes on linux
+    report['meta']['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return report
+
+def compare(old, new):
+    """Return lines of per-stage median ratios (new / old)."""
+    lines = ['{:<24}{:<14}{:>10}{:>10}{:>8}'.format('case', 'stage', 'old(ms)',
+        'new(ms)', 'ratio')]
+    for name, case in new['cases'].items():
+        if name not in old['cases']:
+            continue
+        old_case = old['cases'][name]
+        items = list(case['stages'].items()) + [('total', case['total'])]
+        for stage, value in items:
+            if stage == 'total':
+                old_value = old_case['total']
+            elif stage in old_case['stages']:
+                old_value = old_case['stages'][stage]
+            else:
+                continue
+            a, b = old_value['median'] * 1000, value['median'] * 1000
+            ratio = b / a if a else float('nan')
+            lines.append('{:<24}{:<14}{:>10.1f}{:>10.1f}{:>8.2f}'.format(name,
+                stage, a, b, ratio))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark satellite pipeline '
+        'with synthetic HSD files.')
+    parser.add_argument('-o', '--output', help='write JSON report to this file')
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('-c', '--case', action='append',
+        help='only run given case(s), available: ' + ', '.join(
+        c['name'] for c in DEFAULT_CASES))
+    parser.add_argument('--no-memory', action='store_true',
+        help='skip the traced run for peak memory')
+    parser.add_argument('--compare', help='JSON report to compare against')
+    args = parser.parse_args(argv)
+    cases = DEFAULT_CASES
+    if args.case:
+        cases = [c for c in DEFAULT_CASES if c['name'] in args.case]
+    report = run(cases, repeat=args.repeat, trace_memory=not args.no_memory)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print('\n'.join(compare(old, report)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'windygram.settings')
+    django.setup()
+    main()
@@ -18,6 +18,8 @@ NUM_OF_MEMS = 50 #num of ensemble members
 
 class WindRadiiPlot:
 
+    wind_reprs = ('34kt', '50kt', '64kt')
+
     def __init__(self, storm, georange):
         self.storm = storm
         self.georange = georange
@@ -34,12 +36,9 @@ class WindRadiiPlot:
         logger.info('Make wind radii plot for %s', self.storm)
         self.storm.load_radii()
         self.make_grid()
-        self.wind_repr = '34kt'
-        self.make_plot(0)
-        self.wind_repr = '50kt'
-        self.make_plot(1)
-        self.wind_repr = '64kt'
-        self.make_plot(2)
+        for radii_num, wind_repr in enumerate(self.wind_reprs):
+            self.wind_repr = wind_repr
+            self.make_plot(radii_num)
 
     def make_plot(self, radii_num):
         logger.info('Plot %s radii probs for %s', self.wind_repr, self.storm)
@@ -141,10 +140,13 @@ class WindRadiiPlot:
             time[:4], time[4:6], time[6:8], time[8:]))
         self.plot.draw('meripara country province coastline')
 
+    @staticmethod
+    def target_path(storm, wind_repr):
+        return os.path.join(settings.MEDIA_ROOT, 'typhoon/ensemble/{}/{}{}.png'\
+            ''.format(storm.basetime, storm.codename, wind_repr))
+
     def save(self):
-        filename = 'typhoon/ensemble/{}/{}{}.png'.format(self.storm.basetime,
-            self.storm.codename, self.wind_repr)
-        filepath = os.path.join(settings.MEDIA_ROOT, filename)
+        filepath = self.target_path(self.storm, self.wind_repr)
         self.plot.save(filepath, facecolor='#F8F8F8')
         logger.info('Export to {}'.format(filepath))
         self.plot.clear()
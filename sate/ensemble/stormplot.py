@@ -14,6 +14,7 @@ from shapely.geometry import (
     LineString, MultiLineString, MultiPolygon, Point, Polygon, box)
 
 from sate.ensemble.radiiplot import WindRadiiPlot
+from tools import ledger
 from tools.metplot.plotplus import Plot
 from tools.utils import geoscale
 
@@ -79,26 +80,38 @@ class StormPlot:
     code_ens = ['en%02d' % i for i in range(1, 26)]
     code_sps = ['emx', 'eemn', 'ec00']
 
-    def __init__(self, basetime, storms):
+    def __init__(self, basetime, storms, force=False):
         self.basetime = basetime
         self.storms = storms
+        self.force = force
         self.four_colors = ['#AAFFAA', '#FFFF44', '#FF3333', '#BB0044']
         self.four_descr = ['10~25%', '25~50%', '50~75%', '>75%']
 
     def plot_all(self):
         self.plotted = []
         for storm in self.storms:
+            # Plots of a storm only change with its BUFR file.
+            fingerprint = ledger.fingerprint('storm', storm.codename,
+                files=(storm.filepath,))
+            if not self.force and all(ledger.is_rendered(path, fingerprint)
+                    for path in self.output_paths(storm)):
+                logger.info('Skip unchanged storm {}'.format(storm.codename))
+                self.plotted.append(storm)
+                continue
             storm.load(qc_method='strict')
             if storm.valid_points < VALID_POINTS_THRESHOLD:
                 continue
             try:
-                self.plot_storm(storm)
+                written = self.plot_storm(storm)
             except Exception as exc:
                 logger.exception('Error while plotting {}'.format(storm.codename))
             else:
+                for path in written:
+                    ledger.record(path, fingerprint)
                 self.plotted.append(storm)
 
     def plot_storm(self, storm):
+        """Make all plots of storm and return paths of the images written."""
         logger.info('Plot storm for {}'.format(storm.codename))
         self.storm = storm
         self.georange = roundit(geoscale(*self.storm.get_georange(), pad=1.5))
@@ -117,10 +130,14 @@ class StormPlot:
         if not NO_SUBPLOT:
             self.plot_subplot()
         self.save()
+        written = [self.target_path(storm)]
         try:
             WindRadiiPlot(self.storm, self.ngeorange).make_plots()
         except:
             logger.exception('Failed to make wind radii plot for %s', self.storm)
+        else:
+            written.extend(self.output_paths(storm)[1:])
+        return written
 
     def analyze(self):
         x, y, self.prob_grid = get_grids(self.georange)
@@ -303,9 +320,17 @@ class StormPlot:
                 edgecolor='k', linewidth=0.4, zorder=3, alpha=0.8)
             self.p.ax.add_collection(patch)
 
+    def target_path(self, storm):
+        return os.path.join(settings.MEDIA_ROOT,
+            'typhoon/ensemble/{}/{}.png'.format(self.basetime, storm.codename))
+
+    def output_paths(self, storm):
+        """Storm plot and wind radii plots, in this order."""
+        return [self.target_path(storm)] + [WindRadiiPlot.target_path(storm,
+            wind_repr) for wind_repr in WindRadiiPlot.wind_reprs]
+
     def save(self):
-        filepath = os.path.join(settings.MEDIA_ROOT,
-            'typhoon/ensemble/{}/{}.png'.format(self.basetime, self.storm.codename))
+        filepath = self.target_path(self.storm)
         self.p.save(filepath, facecolor='#F8F8F8')
         logger.info('Export to {}'.format(filepath))
         self.p.clear()
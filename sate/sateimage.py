@@ -18,6 +18,7 @@ from sate.format import HimawariFormat, MutilSegmentHimawariFormat
 from sate.satefile import SateFile
 from tools.cache import Key
 from tools.diagnosis.manager import DiagnosisSourceManager
+from tools.metplot.figpool import acquire_figure, release_figure
 from tools.utils import is_file_valid
 
 matplotlib.use('agg')
@@ -35,6 +36,9 @@ DIAGTEXT_YEND = 0.08
 DIAGTEXT_LEFTX = 0.055
 DIAGTEXT_YSTEP = 0.018
 
+PROVINCE_SHAPEFILE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'tools/metplot/shapefile/CP/ChinaProvince')
+
 #TODO: Mercator
 
 
@@ -231,13 +235,16 @@ class SateImage:
 
     def imager(self):
         self.georange, self.lons, self.lats, self.data = self.extract()
-        lat1, lat2, lon1, lon2 = self.georange
         # PLOT
         self.map = self.make_map()
         # Plot data
         extent, target_xy = self.remap_data()
+        self.render(extent, target_xy)
+
+    def render(self, extent, target_xy):
+        lat1, lat2, lon1, lon2 = self.georange
         for enh in self.enhances:
-            self.fig = plt.figure(figsize=(self.figwidth / self.dpi, self.figheight / self.dpi))
+            self.fig = acquire_figure((self.figwidth / self.dpi, self.figheight / self.dpi))
             self.ax = self.fig.add_axes([0, 0, 1, 1])
             if self.satefile.band <= 3:
                 cos_zenith = cos_zen(self.satefile.time, target_xy[0], target_xy[1])
@@ -259,7 +266,7 @@ class SateImage:
                 vmax = 50
             self.map.imshow(self.data, extent=extent, cmap=cmap, vmin=vmin, vmax=vmax)
             self.map.drawcoastlines(linewidth=0.4, color='w')
-            self.map.readshapefile('/root/web/windygram/tools/metplot/shapefile/CP/ChinaProvince', 'Province', linewidth=0.2, color='w', ax=self.ax)
+            self.map.readshapefile(PROVINCE_SHAPEFILE, 'Province', linewidth=0.2, color='w', ax=self.ax)
             if enh:
                 xoffset = (lon2 - lon1) / 30
                 self.map.drawparallels(np.arange(-90,90,1), linewidth=0.2, dashes=(None, None),
@@ -283,8 +290,7 @@ class SateImage:
             os.makedirs(os.path.dirname(export_path), exist_ok=True)
             plt.savefig(export_path, dpi=self.dpi, facecolor=self.bgcolor)
             logger.info('Export to {}'.format(export_path))
-            plt.clf()
-            plt.close()
+            release_figure(self.fig)
             # copy to latest dir
             latest_path = self.satefile.latest_path.format(enh=enh_str)
             shutil.copyfile(export_path, latest_path)
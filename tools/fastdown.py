@@ -1,12 +1,13 @@
+import contextlib
 import ftplib
 import re
 import os
 import shutil
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor, Future
 
-import boto3
 import requests
-from botocore.exceptions import ClientError
 
 from tools.utils import is_file_valid
 
@@ -245,14 +246,232 @@ class SerialFTPFastDown(FTPFastDown):
         self.targets = []
 
 
+class FTPConnectionPool:
+    """A fixed number of logged-in FTP connections shared by downloader threads.
+
+    Connections are opened lazily. A connection idle for longer than
+    `keepalive` seconds is checked with NOOP before it is handed out, and a
+    dead or broken one is replaced by a new login."""
+
+    def __init__(self, host, user='', passwd='', port=21, size=4, timeout=30,
+            keepalive=60):
+        self.host = host
+        self.user = user
+        self.passwd = passwd
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.keepalive = keepalive
+        # Idle connections with the time they were released, latest last.
+        # `created` counts idle and handed out connections, both are guarded
+        # by `cond`, which is notified whenever either changes so that a
+        # thread waiting for a connection may take or create one.
+        self.idle = []
+        self.created = 0
+        self.cond = threading.Condition()
+
+    def connect(self):
+        ftp = ftplib.FTP(timeout=self.timeout)
+        ftp.connect(self.host, self.port)
+        ftp.login(self.user, self.passwd)
+        return ftp
+
+    def acquire(self):
+        with self.cond:
+            while not self.idle and self.created >= self.size:
+                self.cond.wait()
+            if self.idle:
+                ftp, last_used = self.idle.pop()
+            else:
+                self.created += 1
+                ftp, last_used = None, None
+        if ftp is None:
+            return self._connect_or_forget()
+        if time.time() - last_used > self.keepalive:
+            try:
+                ftp.voidcmd('NOOP')
+            except Exception:
+                self._close_quietly(ftp)
+                ftp = self._connect_or_forget()
+        return ftp
+
+    def release(self, ftp, broken=False):
+        if broken:
+            self._close_quietly(ftp)
+        with self.cond:
+            if broken:
+                self.created -= 1
+            else:
+                self.idle.append((ftp, time.time()))
+            self.cond.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        ftp = self.acquire()
+        try:
+            yield ftp
+        except ftplib.error_perm:
+            # e.g. 550 file not found, the connection itself is fine.
+            self.release(ftp)
+            raise
+        except Exception:
+            self.release(ftp, broken=True)
+            raise
+        else:
+            self.release(ftp)
+
+    def ping(self):
+        """Send NOOP on all idle connections, replacing dead ones."""
+        with self.cond:
+            idle, self.idle = self.idle, []
+        for ftp, _ in idle:
+            try:
+                ftp.voidcmd('NOOP')
+            except Exception:
+                self.release(ftp, broken=True)
+            else:
+                self.release(ftp)
+
+    def close(self):
+        with self.cond:
+            idle, self.idle = self.idle, []
+            self.created -= len(idle)
+            self.cond.notify_all()
+        for ftp, _ in idle:
+            try:
+                ftp.quit()
+            except Exception:
+                self._close_quietly(ftp)
+
+    def _connect_or_forget(self):
+        try:
+            return self.connect()
+        except Exception:
+            with self.cond:
+                self.created -= 1
+                self.cond.notify()
+            raise
+
+    def _close_quietly(self, ftp):
+        try:
+            ftp.close()
+        except Exception:
+            pass
+
+
+class FTPDirectoryWatcher:
+    """Track files appearing in a remote directory, one listing per poll.
+
+    MLSD is preferred, NLST is used when the server doesn't support it. A
+    directory which doesn't exist yet is treated as empty."""
+
+    def __init__(self, pool, directory):
+        self.pool = pool
+        self.directory = directory
+        self.listed = set()
+        self.use_mlsd = True
+
+    def list(self):
+        with self.pool.connection() as ftp:
+            try:
+                if self.use_mlsd:
+                    try:
+                        return {name for name, facts in ftp.mlsd(self.directory,
+                            facts=['type']) if facts.get('type', 'file') == 'file'}
+                    except ftplib.error_perm as err:
+                        code = str(err)[:3]
+                        if code not in ('500', '501', '502'):
+                            raise
+                        # 501 may just be a missing directory, try NLST this
+                        # time but don't give up MLSD for good.
+                        if code != '501':
+                            self.use_mlsd = False
+                return {os.path.basename(name) for name in ftp.nlst(self.directory)}
+            except (ftplib.error_perm, ftplib.error_temp) as err:
+                if str(err)[:3] in ('450', '550'):
+                    return set()
+                raise
+
+    def poll(self):
+        """List the directory and return names not seen in previous polls."""
+        names = self.list()
+        new = names - self.listed
+        self.listed |= names
+        return new
+
+
+class PooledFTPDownloader(BaseDownloader):
+
+    def __call__(self, task):
+        return self.single(task)
+
+    def set_pool(self, pool):
+        self.pool = pool
+
+    def single(self, task):
+        filename = os.path.join(self.basedir, task.filename)
+        if not is_file_valid(filename, filesize_threshold=0):
+            # Write to a temporary file first, a half-downloaded file must
+            # never be mistaken for a finished one.
+            part_filename = filename + '.part'
+            try:
+                with self.pool.connection() as ftp:
+                    with open(part_filename, 'wb') as f:
+                        ftp.retrbinary('RETR {}'.format(task.url), f.write)
+            except Exception as err:
+                if os.path.exists(part_filename):
+                    os.remove(part_filename)
+                return self.failed(task)
+            os.replace(part_filename, filename)
+        if self.success_callback:
+            self.success_callback(filename, task.callback_args)
+
+
+class PooledFTPFastDown(FastDown):
+    """Download files in parallel over a pool of persistent FTP connections,
+    one file per connection at a time."""
+
+    default_service = PooledFTPDownloader
+
+    def __init__(self, file_parallel=1, chunk_parallel=1, chunk_size=None, retry=5, timeout=3):
+        if chunk_parallel != 1:
+            raise ValueError('Files are downloaded whole, one per connection.')
+        super().__init__(file_parallel, chunk_parallel, chunk_size, retry, timeout)
+
+    def set_pool(self, pool):
+        self.pool = pool
+        self.file_parallel = pool.size
+
+    def download(self):
+        downloader = self.service(self.chunk_parallel, self.chunk_size, self.retry, self.timeout)
+        downloader.set_basedir(self.basedir)
+        downloader.set_pool(self.pool)
+        if self.success_callback:
+            downloader.success_callback = self.success_callback
+        if self.failed_callback:
+            downloader.failed_callback = self.failed_callback
+        with ThreadPoolExecutor(max_workers=self.file_parallel) as executor:
+            downloader.set_executor(executor)
+            futures = executor.map(downloader, self.targets)
+            self.targets = []
+            for future in futures:
+                while isinstance(future, Future):
+                    future = future.result()
+
+
 class S3FastDown(FastDown):
 
-    s3 = boto3.resource('s3')
+    # boto3 is only needed by satellite tasks, it is imported on first use.
+    s3 = None
 
     def set_bucket(self, bucket):
         self.bucket = bucket
 
     def download(self):
+        import boto3
+        from botocore.exceptions import ClientError
+        if S3FastDown.s3 is None:
+            S3FastDown.s3 = boto3.resource('s3')
         try:
             for task in self.targets:
                 self.s3.meta.client.download_file(self.bucket, task.url, task.filename)
@@ -0,0 +1,56 @@
+"""Ledger of rendered images, to skip renders whose inputs haven't changed.
+
+A render is identified by its output path, and its inputs by a fingerprint:
+a hash of plot parameters, identity (path, size, mtime) of input files and
+optionally raw bytes of input data. Reruns, retries and duplicate dispatches
+check the ledger and only render outputs which are missing or stale.
+"""
+import hashlib
+import os
+
+from django.core.cache import cache
+
+from tools.cache import DAY
+
+LEDGER_KEY = 'RENDER_{}'
+LEDGER_TIMEOUT = 7 * DAY
+
+
+def fingerprint(*parts, files=(), data=()):
+    """Hash of plot parameters `parts`, input `files` and input arrays or
+    bytes `data`. Missing files hash differently from any existing file."""
+    sha = hashlib.sha1()
+    for part in parts:
+        sha.update(repr(part).encode())
+        sha.update(b'\0')
+    for path in files:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            sha.update('{}:missing'.format(path).encode())
+        else:
+            sha.update('{}:{}:{}'.format(path, stat.st_size,
+                stat.st_mtime_ns).encode())
+    for item in data:
+        sha.update(item if isinstance(item, bytes) else item.tobytes())
+    return sha.hexdigest()
+
+def code_identity(func):
+    """Changes whenever the body of a plot function is edited."""
+    code = func.__code__
+    return hashlib.sha1(code.co_code + repr(code.co_consts).encode()).hexdigest()
+
+def _key(target_path):
+    return LEDGER_KEY.format(hashlib.sha1(os.path.abspath(
+        target_path).encode()).hexdigest())
+
+def is_rendered(target_path, print_):
+    """Whether target exists and was rendered from inputs with fingerprint
+    `print_`."""
+    return os.path.exists(target_path) and cache.get(_key(target_path)) == print_
+
+def record(target_path, print_):
+    cache.set(_key(target_path), print_, LEDGER_TIMEOUT)
+
+def forget(target_path):
+    cache.delete(_key(target_path))
@@ -1,12 +1,17 @@
+import hashlib
 import os
 
 from django.conf import settings
 
-from tools.metplot.plotplus import MapSet, Plot
+from tools.metplot.plotplus import (MapSet, Plot, set_coords_cache_dir,
+                                    set_feature_cache_dir)
 
 __warehouse__ = os.path.join(os.path.dirname(__file__), 'mapstore')
 __mapbooks__ = {}
 
+set_feature_cache_dir(os.path.join(settings.TMP_ROOT, 'mapfeatures'))
+set_coords_cache_dir(os.path.join(settings.TMP_ROOT, 'mapcoords'))
+
 
 class MapArea:
 
@@ -26,11 +31,26 @@ class MapArea:
     def pkey(self):
         return self.key.replace(' ', '_').replace('&', '').lower()
 
+    @property
+    def source(self):
+        """Identity of the configuration the mapset is made from."""
+        return hashlib.md5(repr(sorted(self.kwargs.items())).encode()).hexdigest()
+
     def load(self):
         return MapSet.load(self.path)
 
+    def is_made(self):
+        """Whether the mapset on disk was made from current configuration."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            return self.load().source == self.source
+        except Exception:
+            return False
+
     def make(self, pc=False):
         mapset = MapSet.from_natural_earth(**self.kwargs)
+        mapset.source = self.source
         mapset.save(self.path)
         if pc:
             self.political_correctness()
@@ -52,6 +72,8 @@ class MapArea:
         boundaries. So we have to do some work to rewrite the boundaries, which is a
         little bit hacky. As its side effect, border between India and Myanmar may be
         problematic."""
+        from cartopy.crs import PlateCarree
+        from cartopy.feature import ShapelyFeature
         from shapely.geometry import GeometryCollection, Polygon, box
         import pickle
         SOUTH_TIBET_POLYGON = [
@@ -70,7 +92,7 @@ class MapArea:
         if not geobox.intersects(south_tibet):
             return
         mapset = self.load()
-        geoms = mapset.country._geoms
+        geoms = list(mapset.country.geometries())
         # remove south tibet region from original shapefile
         new_geoms = []
         for g in geoms:
@@ -84,7 +106,7 @@ class MapArea:
         patch = pickle.load(open(os.path.join(__warehouse__,
             'south_tibet_patch.pkl'), 'rb'))
         new_geoms += patch
-        mapset.country._geoms = new_geoms
+        mapset.country = ShapelyFeature(new_geoms, PlateCarree())
         mapset.save(self.path)
 
     @classmethod
@@ -110,13 +132,23 @@ def get_area_keys(area=None):
     keys = [region.key for region in regions]
     return keys
 
-def _make_all():
+def _make_all(force=False):
+    """Make mapsets of all areas. Natural Earth shapefiles are read once and
+    shared by all areas, and areas whose mapset is up to date are skipped
+    unless `force`, so adding an area only clips that one."""
     for m in MapArea.maps.values():
+        if not force and m.is_made():
+            continue
         print(m)
-        m.make()
-        m.political_correctness()
+        m.make(pc=True)
         m.thumbnail()
 
+def _convert_all():
+    """Rewrite mapsets pickled by older versions in the binary format."""
+    for m in MapArea.maps.values():
+        if os.path.exists(m.path):
+            m.load().save(m.path)
+
 def load_china_polygon():
     import cartopy.io.shapereader as ciosr
     from cartopy.mpl.patch import geos_to_path
@@ -11,8 +11,16 @@ CONTROL_COLOR = 1
 TRANSIT_COLOR = 2
 
 
+_cmap_cache_ = {}
+
 def cmap(inp):
     '''return cmap dict including plotplus control information ( levels and unit )'''
+    if isinstance(inp, str):
+        # Colormap files are parsed once per process. Callers pop keys from the
+        # returned dict, so a shallow copy is handed out every time.
+        if inp not in _cmap_cache_:
+            _cmap_cache_[inp] = Colormap(inp).process()
+        return dict(_cmap_cache_[inp])
     c = Colormap(inp)
     return c.process()
 
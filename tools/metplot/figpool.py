@@ -0,0 +1,60 @@
+"""Per-process pool of matplotlib figures.
+
+Creating a pyplot figure sets up a figure manager, an Agg canvas and a fresh
+figure patch and layout, for every plot of a worker plotting thousands of
+them an hour. Plots take figures of their size from here instead and give
+them back when saved. Released figures are cleared of all axes and artists
+and their figure-level settings are reset, so the next plot starts from the
+same state as with a new figure. Plots may resize their figure, e.g. to the
+aspect of a map, so a figure is given back at, and pooled under, the size it
+was acquired with.
+"""
+from collections import defaultdict
+
+import matplotlib
+import matplotlib.pyplot as plt
+
+MAX_POOLED_FIGURES = 4
+
+_pool_ = defaultdict(list)
+
+
+def acquire_figure(figsize):
+    """Figure of `figsize` inches, made the current pyplot figure."""
+    figsize = tuple(float(i) for i in figsize)
+    figures = _pool_[figsize]
+    while figures:
+        fig = figures.pop()
+        if plt.fignum_exists(fig.number):
+            plt.figure(fig.number)
+            return fig
+    fig = plt.figure(figsize=figsize)
+    fig._pool_figsize = figsize
+    return fig
+
+def release_figure(fig):
+    """Clear figure and keep it for the next plot of its size. Figures still
+    holding artists after clearing, e.g. added behind pyplot's back, are
+    closed rather than risk leaking them into other plots."""
+    fig.clf()
+    figsize = getattr(fig, '_pool_figsize', None)
+    if figsize is None:
+        figsize = tuple(float(i) for i in fig.get_size_inches())
+        fig._pool_figsize = figsize
+    figures = _pool_[figsize]
+    # The figure patch is the only child of an empty figure.
+    if len(fig.get_children()) > 1 or len(figures) >= MAX_POOLED_FIGURES or \
+            not plt.fignum_exists(fig.number):
+        plt.close(fig)
+        return
+    rc = matplotlib.rcParams
+    fig.subplots_adjust(left=rc['figure.subplot.left'],
+        right=rc['figure.subplot.right'], bottom=rc['figure.subplot.bottom'],
+        top=rc['figure.subplot.top'], wspace=rc['figure.subplot.wspace'],
+        hspace=rc['figure.subplot.hspace'])
+    fig.set_facecolor(rc['figure.facecolor'])
+    fig.set_edgecolor(rc['figure.edgecolor'])
+    fig.dpi = rc['figure.dpi']
+    fig.set_size_inches(figsize)
+    if fig not in figures:
+        figures.append(fig)
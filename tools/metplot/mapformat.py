@@ -0,0 +1,180 @@
+"""Binary file format of MapSets.
+
+A mapset file holds the geometries of every layer as flat coordinate arrays
+plus offsets, and a small JSON header describing where each array lives:
+
+    magic (8 bytes) | header length (uint64) | JSON header | arrays
+
+Every layer is a list of geometries made of parts (lines or polygons) made
+of rings (a line, or polygon exterior and interiors) made of coordinates:
+
+    kinds        int8     (geoms,)       geometry type, see `KINDS`
+    bounds       float64  (geoms, 4)     minx, miny, maxx, maxy
+    geom_parts   int64    (geoms + 1,)   offsets into parts
+    part_rings   int64    (parts + 1,)   offsets into rings
+    ring_coords  int64    (rings + 1,)   offsets into coords
+    coords       float64  (points, 2)
+
+Files are memory-mapped on load and geometries are only built when a plot
+asks for them, and then only those whose bounds meet the requested extent.
+"""
+import json
+import os
+import struct
+
+import cartopy.crs as ccrs
+import cartopy.feature as cfeature
+import numpy as np
+
+MAGIC = b'MAPSET\x01\n'
+KINDS = ('LineString', 'MultiLineString', 'Polygon', 'MultiPolygon')
+_ARRAYS = (('kinds', np.int8), ('bounds', np.float64), ('geom_parts', np.int64),
+    ('part_rings', np.int64), ('ring_coords', np.int64), ('coords', np.float64))
+
+
+def is_mapset_file(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def _split_parts(geom):
+    """Parts of geometry as lists of rings."""
+    kind = geom.geom_type
+    if kind == 'LineString':
+        return [[geom.coords]]
+    if kind == 'MultiLineString':
+        return [[g.coords] for g in geom.geoms]
+    if kind == 'Polygon':
+        return [[geom.exterior.coords] + [i.coords for i in geom.interiors]]
+    if kind == 'MultiPolygon':
+        return [[g.exterior.coords] + [i.coords for i in g.interiors]
+            for g in geom.geoms]
+    raise ValueError('Unsupported geometry type: ' + kind)
+
+def _flatten(geoms):
+    for geom in geoms:
+        if geom.is_empty:
+            continue
+        if geom.geom_type == 'GeometryCollection':
+            yield from _flatten(geom.geoms)
+        else:
+            yield geom
+
+def pack_geometries(geoms):
+    kinds, bounds, geom_parts, part_rings, ring_coords = [], [], [0], [0], [0]
+    coords = []
+    for geom in _flatten(geoms):
+        kinds.append(KINDS.index(geom.geom_type))
+        bounds.append(geom.bounds)
+        for rings in _split_parts(geom):
+            for ring in rings:
+                ring = np.asarray(ring, dtype=np.float64)[:, :2]
+                coords.append(ring)
+                ring_coords.append(ring_coords[-1] + len(ring))
+            part_rings.append(part_rings[-1] + len(rings))
+        geom_parts.append(len(part_rings) - 1)
+    return {
+        'kinds': np.array(kinds, dtype=np.int8),
+        'bounds': np.array(bounds, dtype=np.float64).reshape(-1, 4),
+        'geom_parts': np.array(geom_parts, dtype=np.int64),
+        'part_rings': np.array(part_rings, dtype=np.int64),
+        'ring_coords': np.array(ring_coords, dtype=np.int64),
+        'coords': np.concatenate(coords) if coords else np.empty((0, 2))
+    }
+
+def write_mapset(filename, meta, layers):
+    """Write `meta`, a JSON serializable dict, and `layers`, a dict of layer
+    name to iterable of shapely geometries in PlateCarree coordinates."""
+    index = {}
+    blobs = []
+    offset = 0
+    for name, geoms in layers.items():
+        arrays = pack_geometries(geoms)
+        index[name] = {}
+        for key, dtype in _ARRAYS:
+            data = np.ascontiguousarray(arrays[key], dtype=dtype)
+            index[name][key] = [offset, data.shape]
+            blobs.append(data.tobytes())
+            offset += data.nbytes
+    header = json.dumps({'meta': meta, 'layers': index}).encode()
+    # Pad header so that all arrays are aligned to 8 bytes in the file.
+    header += b' ' * (-(len(MAGIC) + 8 + len(header)) % 8)
+    tmp_name = filename + '.tmp'
+    with open(tmp_name, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    # Renamed into place, workers having the old file mapped keep reading it.
+    os.replace(tmp_name, filename)
+
+def read_mapset(filename):
+    """Return meta and dict of layer name to `PackedFeature`. Only the header
+    is read, arrays are memory-mapped."""
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not a mapset file: ' + filename)
+        length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length).decode())
+    start = len(MAGIC) + 8 + length
+    buffer = np.memmap(filename, mode='r')
+    layers = {}
+    for name, index in header['layers'].items():
+        arrays = {}
+        for key, dtype in _ARRAYS:
+            offset, shape = index[key]
+            count = int(np.prod(shape))
+            arrays[key] = np.frombuffer(buffer, dtype=dtype, count=count,
+                offset=start + offset).reshape(shape)
+        layers[name] = PackedFeature(arrays)
+    return header['meta'], layers
+
+
+class PackedFeature(cfeature.Feature):
+    """Cartopy feature backed by packed arrays of a mapset file. Geometries
+    are built on first request and kept for later plots."""
+
+    def __init__(self, arrays, **kwargs):
+        super().__init__(ccrs.PlateCarree(), **kwargs)
+        self.arrays = arrays
+        self._built = {}
+
+    def __len__(self):
+        return len(self.arrays['kinds'])
+
+    def geometry(self, i):
+        if i not in self._built:
+            self._built[i] = self._build(i)
+        return self._built[i]
+
+    def _build(self, i):
+        from shapely.geometry import (LineString, MultiLineString,
+                                      MultiPolygon, Polygon)
+        a = self.arrays
+        parts = []
+        for p in range(a['geom_parts'][i], a['geom_parts'][i + 1]):
+            rings = [np.array(a['coords'][a['ring_coords'][r]:a['ring_coords'][r + 1]])
+                for r in range(a['part_rings'][p], a['part_rings'][p + 1])]
+            parts.append(rings)
+        kind = KINDS[a['kinds'][i]]
+        if kind == 'LineString':
+            return LineString(parts[0][0])
+        if kind == 'MultiLineString':
+            return MultiLineString([rings[0] for rings in parts])
+        if kind == 'Polygon':
+            return Polygon(parts[0][0], parts[0][1:])
+        return MultiPolygon([Polygon(rings[0], rings[1:]) for rings in parts])
+
+    def geometries(self):
+        return (self.geometry(i) for i in range(len(self)))
+
+    def intersecting_geometries(self, extent):
+        """Geometries whose bounds meet extent (x0, x1, y0, y1), checked on
+        the packed bounds without building any other geometry."""
+        if extent is None:
+            return self.geometries()
+        x0, x1, y0, y1 = extent
+        bounds = self.arrays['bounds']
+        hit = (bounds[:, 0] <= x1) & (bounds[:, 2] >= x0) & \
+            (bounds[:, 1] <= y1) & (bounds[:, 3] >= y0)
+        return (self.geometry(i) for i in np.flatnonzero(hit))
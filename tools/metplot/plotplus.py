@@ -1,7 +1,9 @@
 import functools
+import hashlib
 import os
 import pickle
 import warnings
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
 import cartopy.crs as ccrs
@@ -9,11 +11,18 @@ import cartopy.feature as cfeature
 import cartopy.io.shapereader as ciosr
 import matplotlib
 matplotlib.use('agg')
+import matplotlib.artist as martist
+import matplotlib.patches as mpatches
+import matplotlib.path as mpath
 import matplotlib.pyplot as plt
+import matplotlib.text as mtext
+import matplotlib.transforms as mtransforms
 import numpy as np
 import scipy.ndimage as snd
 
 import tools.metplot.colorcandy as gpf
+from tools.metplot.figpool import acquire_figure, release_figure
+from tools.metplot.mapformat import is_mapset_file, read_mapset, write_mapset
 
 __version__ = '0.4.0'
 
@@ -27,6 +36,33 @@ _gray = '#222222'
 _projshort = dict(P='PlateCarree', L='LambertConformal', M='Mercator',
     N='NorthPolarStereo', G='Geostationary')
 _scaleshort = dict(l='110m', i='50m', h='10m')
+# Same as cartopy features: above filled contours and images, below lines.
+_feature_zorder = 1.5
+_max_cached_features = 64
+_max_cached_coords = 32
+# Tolerances in degrees for simplification of map features, few levels so
+# that projected paths of similar maps are shared in cache.
+_simplify_levels = (0., 0.005, 0.01, 0.02, 0.05, 0.1)
+
+
+_profiler_ = None
+
+def set_profiler(profiler):
+    """Report wall time of plotting stages to `profiler.stage(name)`, which
+    should give a context manager. See `model.profiling`."""
+    global _profiler_
+    _profiler_ = profiler
+
+def profiled(stage):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler_ is None:
+                return func(*args, **kwargs)
+            with _profiler_.stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
 
 
 class PlotError(Exception):
@@ -81,7 +117,7 @@ class Plot:
         self.dpi = dpi
         if figsize is None:
             figsize = 6.3, 4.5
-        self.fig = plt.figure(figsize=figsize)
+        self.fig = acquire_figure(figsize)
         self.ax = None
         self.mpstep = 10
         self.mapset = None
@@ -130,6 +166,7 @@ class Plot:
         self.yy = y
         self.uneven_xy = True
 
+    @profiled('setmap')
     def setmap(self, key=None, proj=None, projection=None, resolution='i',
             **kwargs):
         """Set underlying map for the plot.
@@ -284,52 +321,108 @@ class Plot:
         color = self.linecolor['coastline'] if color is None else color
         res = res if res else self.scale
         if self.mapset and self.mapset.coastline:
-            self.usefeature(self.mapset.coastline, edgecolor=color, facecolor='none',
-                linewidth=lw)
+            self.addfeature('coastline', lambda: self.mapset.coastline,
+                edgecolor=color, linewidth=lw)
         else:
-            self.ax.add_feature(self.getfeature('physical', 'coastline', res,
-                facecolor='none', edgecolor=color), linewidth=lw)
+            self.addfeature('coastline_' + res, lambda: self.getfeature('physical',
+                'coastline', res), edgecolor=color, linewidth=lw)
 
     def drawcountry(self, lw=None, color=None, res=None):
         lw = self.linewidth['country'] if lw is None else lw
         color = self.linecolor['country'] if color is None else color
         res = res if res else self.scale
         if self.mapset and self.mapset.country:
-            self.usefeature(self.mapset.country, edgecolor=color, facecolor='none',
-                linewidth=lw)
+            self.addfeature('country', lambda: self.mapset.country,
+                edgecolor=color, linewidth=lw)
         else:
-            self.ax.add_feature(self.getfeature('cultural',
-                'admin_0_boundary_lines_land', res, facecolor='none',
-                edgecolor=color), linewidth=lw)
+            self.addfeature('country_' + res, lambda: self.getfeature('cultural',
+                'admin_0_boundary_lines_land', res), edgecolor=color, linewidth=lw)
 
     @functools.lru_cache(maxsize=32)
     def getfeature(self, *args, **kwargs):
         return cfeature.NaturalEarthFeature(*args, **kwargs)
 
+    def addfeature(self, name, get_feature, facecolor='none', edgecolor=None,
+            **kwargs):
+        """Add feature as a single patch of paths already projected onto the map.
+
+        Projecting geometries is the most expensive part of drawing a map
+        background, so projected paths are cached by map, projection and
+        feature name. Colors and widths are applied per plot. `get_feature` is
+        only called on cache miss, so that shapefiles are not read at all when
+        paths are cached.
+
+        Geometries are simplified beforehand to the coarsest level of
+        `_simplify_levels` finer than half a pixel of the map, detail below
+        that is invisible but would still be projected and rasterized."""
+        tolerance = self._simplify_tolerance()
+        key = self._map_key() + (name, tolerance)
+        path = get_projected_path(key, lambda: self._project_feature(get_feature(),
+            tolerance=tolerance))
+        kwargs.setdefault('zorder', _feature_zorder)
+        patch = mpatches.PathPatch(path, facecolor=facecolor, edgecolor=edgecolor,
+            transform=self.ax.transData, **kwargs)
+        self.ax.add_patch(patch)
+        return patch
+
+    def _map_key(self):
+        if self.mapset is not None and getattr(self.mapset, 'key', None):
+            source = self.mapset.key
+        else:
+            source = tuple(self.map_georange)
+        return source, self.ax.projection.proj4_init
+
+    def _simplify_tolerance(self):
+        """Simplification level in degrees for features of this map."""
+        x0, x1, y0, y1 = self.ax.get_extent(ccrs.PlateCarree())
+        position = self.ax.get_position()
+        width, height = self.fig.get_size_inches() * self.dpi
+        per_pixel = max((x1 - x0) / (position.width * width),
+            (y1 - y0) / (position.height * height))
+        return max(l for l in _simplify_levels if l <= per_pixel / 2)
+
+    def _project_feature(self, feature, tolerance=0.):
+        from cartopy.mpl.patch import geos_to_path
+        extent = self.ax.get_extent(feature.crs)
+        paths = []
+        for geom in feature.intersecting_geometries(extent):
+            if tolerance:
+                geom = geom.simplify(tolerance, preserve_topology=True)
+                if geom.is_empty:
+                    continue
+            projected = self.ax.projection.project_geometry(geom, feature.crs)
+            paths.extend(geos_to_path(projected))
+        if not paths:
+            return mpath.Path(np.empty((0, 2)))
+        return mpath.Path.make_compound_path(*paths)
+
     def drawprovince(self, lw=None, color=None):
         lw = self.linewidth['province'] if lw is None else lw
         color = self.linecolor['province'] if color is None else color
         if self.mapset and self.mapset.province:
-            self.usefeature(self.mapset.province, edgecolor=color, facecolor='none',
-                linewidth=lw)
+            self.addfeature('province', lambda: self.mapset.province,
+                edgecolor=color, linewidth=lw)
         else:
-            self.ax.add_feature(cfeature.ShapelyFeature(
-                ciosr.Reader(_ProvinceDir).geometries(), ccrs.PlateCarree(),
-                facecolor='none', edgecolor=color), linewidth=lw)
+            self.addfeature('province_china', lambda: cfeature.ShapelyFeature(
+                ciosr.Reader(_ProvinceDir).geometries(), ccrs.PlateCarree()),
+                edgecolor=color, linewidth=lw)
 
     def drawcity(self, lw=None, color=None):
         lw = self.linewidth['city'] if lw is None else lw
         color = self.linecolor['city'] if color is None else color
-        self.ax.add_feature(cfeature.ShapelyFeature(ciosr.Reader(_CityDir).geometries(),
-            ccrs.PlateCarree(), facecolor='none', edgecolor=color), linewidth=lw)
-        self.ax.add_feature(cfeature.ShapelyFeature(ciosr.Reader(_CityTWDir).geometries(),
-            ccrs.PlateCarree(), facecolor='none', edgecolor=color), linewidth=lw)
+        self.addfeature('city_china', lambda: cfeature.ShapelyFeature(
+            ciosr.Reader(_CityDir).geometries(), ccrs.PlateCarree()),
+            edgecolor=color, linewidth=lw)
+        self.addfeature('city_taiwan', lambda: cfeature.ShapelyFeature(
+            ciosr.Reader(_CityTWDir).geometries(), ccrs.PlateCarree()),
+            edgecolor=color, linewidth=lw)
 
     def drawcounty(self, lw=None, color=None):
         lw = self.linewidth['county'] if lw is None else lw
         color = self.linecolor['county'] if color is None else color
-        self.ax.add_feature(cfeature.ShapelyFeature(ciosr.Reader(_CountyDir).geometries(),
-            ccrs.PlateCarree(), facecolor='none', edgecolor=color), linewidth=lw)
+        self.addfeature('county_china', lambda: cfeature.ShapelyFeature(
+            ciosr.Reader(_CountyDir).geometries(), ccrs.PlateCarree()),
+            edgecolor=color, linewidth=lw)
 
     def drawparameri(self, lw=None, color=None, fontsize=None, **kwargs):
         if self.proj not in ('PlateCarree', 'Mercator'):
@@ -375,6 +468,7 @@ class Plot:
             gl.xpadding = 3
             gl.ypadding = 2
 
+    @profiled('draw')
     def draw(self, cmd):
         cmd = cmd.lower()
         if ' ' in cmd:
@@ -396,7 +490,8 @@ class Plot:
             else:
                 print('Illegal draw command: %s' % (cmd))
 
-    def interpolation(self, data, ip=1):
+    def interpolation(self, data, ip=1, order=3):
+        """Interpolate data onto a grid `ip` times finer."""
         if self.uneven_xy:
             if ip > 1:
                 print('Uneven x/y are not prepared for interpolation.')
@@ -404,22 +499,28 @@ class Plot:
         elif ip <= 1:
             return self.xx, self.yy, data
         else:
-            nx = np.arange(self.lonmin, self.lonmax+self.res/ip, self.res/ip)
-            ny = np.arange(self.latmin, self.latmax+self.res/ip, self.res/ip)
-            newx, newy = np.meshgrid(nx, ny)
-            xcoords = (len(self.x)-1)*(newx-self.x[0])/(self.x[-1]-self.x[0])
-            ycoords = (len(self.y)-1)*(newy-self.y[0])/(self.y[-1]-self.y[0])
-            coords = [ycoords, xcoords]
-            ndata = snd.map_coordinates(data, coords, order=3, mode='nearest')
-            return newx, newy, ndata
+            key = (self.lonmin, self.lonmax, self.latmin, self.latmax, self.res,
+                ip, order)
+            plan = get_interpolation_plan(key, lambda: InterpolationPlan(self.x,
+                self.y, key[:4], self.res, ip, order))
+            return plan.xx, plan.yy, plan.apply(data)
 
     def transform_data(self, data, ip=1):
+        """Interpolate data and project its lon/lat grid onto the map. Projected
+        coordinates of even grids are cached by grid and projection, so that
+        all layers, params and ticks of a map project them only once."""
         xx, yy, data = self.interpolation(data, ip=ip)
+        if self.uneven_xy:
+            return self._project_coords(xx, yy) + (data,)
+        key = (self.lonmin, self.lonmax, self.latmin, self.latmax, self.res,
+            max(ip, 1), self.ax.projection.proj4_init)
+        xx, yy = get_projected_coords(key, lambda: self._project_coords(xx, yy))
+        return xx, yy, data
+
+    def _project_coords(self, xx, yy):
         ret = self.ax.projection.transform_points(ccrs.PlateCarree(),
             np.array(xx), np.array(yy))
-        xx = ret[..., 0]
-        yy = ret[..., 1]
-        return xx, yy, data
+        return ret[..., 0], ret[..., 1]
 
     def stepcal(self, num, ip=1):
         if self.uneven_xy:
@@ -456,15 +557,17 @@ class Plot:
                 parameri='#D0A85E', province='#D0A85E', city='#D0A85E')
             self.style_colors = (ocean_color, land_color, '#D0A85E')
         if self.mapset and self.mapset.ocean:
-            self.ax.add_feature(self.mapset.ocean, color=ocean_color)
+            self.addfeature('ocean', lambda: self.mapset.ocean,
+                facecolor=ocean_color, edgecolor=ocean_color)
         else:
-            self.ax.add_feature(cfeature.OCEAN.with_scale(self.scale),
-                color=ocean_color)
+            self.addfeature('ocean_' + self.scale, lambda: cfeature.OCEAN.with_scale(
+                self.scale), facecolor=ocean_color, edgecolor=ocean_color)
         if self.mapset and self.mapset.land:
-            self.ax.add_feature(self.mapset.land, color=land_color)
+            self.addfeature('land', lambda: self.mapset.land,
+                facecolor=land_color, edgecolor=land_color)
         else:
-            self.ax.add_feature(cfeature.LAND.with_scale(self.scale),
-                color=land_color)
+            self.addfeature('land_' + self.scale, lambda: cfeature.LAND.with_scale(
+                self.scale), facecolor=land_color, edgecolor=land_color)
 
     def plot(self, *args, **kwargs):
         kwargs.update(transform=ccrs.PlateCarree())
@@ -496,6 +599,7 @@ class Plot:
         kwargs.update(transform=self.ax.transAxes)
         return self.ax.text(*args, **kwargs)
 
+    @profiled('contour')
     def contour(self, data, clabel=True, clabeldict=None, ip=1, color='k', lw=0.5,
             vline=None, vlinedict=None, **kwargs):
         clabeldict = clabeldict or {}
@@ -537,6 +641,7 @@ class Plot:
                         l.set_color(vlinedict['color'])
         return c
 
+    @profiled('contourf')
     def contourf(self, data, gpfcmap=None, cbar=False, cbardict=None, ip=1,
             vline=None, vlinedict=None, **kwargs):
         cbardict = cbardict or {}
@@ -616,6 +721,7 @@ class Plot:
         ret = self.ax.streamplot(self.xx, self.yy, u, v, **kwargs)
         return ret
 
+    @profiled('barbs')
     def barbs(self, u, v, color='k', lw=0.5, length=3.5, num=12, **kwargs):
         kwargs.update(color=color, linewidth=lw, length=length,
             transform=ccrs.PlateCarree(), regrid_shape=num)
@@ -683,14 +789,15 @@ class Plot:
             kwargs.update(path_effects=self._get_stroke_patheffects())
         step = self.stepcal(num)
         kwargs.update(color=color, fontsize=fontsize, ha='center', va='center',
-                      family=self.family, transform=ccrs.PlateCarree(),
-                      zorder=zorder)
+                      family=self.family, zorder=zorder)
+        lons, lats, texts = [], [], []
         if self.proj == 'PlateCarree':
             meri, para = len(self.y), len(self.x)
             for i in range(1, meri-1, step):
                 for j in range(1, para-1, step):
-                    self.ax.text(j*self.res+self.lonmin, i*self.res+self.latmin,
-                                fmt.format(data[i][j]), **kwargs)
+                    lons.append(j*self.res+self.lonmin)
+                    lats.append(i*self.res+self.latmin)
+                    texts.append(fmt.format(data[i][j]))
         else:
             x1, x2, y1, y2 = self.ax.get_extent()
             deltax, deltay = x2 - x1, y2 - y1
@@ -709,7 +816,14 @@ class Plot:
             for i in result:
                 for j in i:
                     lon, lat, value = tuple(j)
-                    self.ax.text(lon, lat, fmt.format(value), **kwargs)
+                    lons.append(lon)
+                    lats.append(lat)
+                    texts.append(fmt.format(value))
+        # Thousands of labels, drawn as one artist rather than one Text each.
+        labels = ValueLabels(lons, lats, texts, ccrs.PlateCarree()._as_mpl_transform(
+            self.ax), **kwargs)
+        self.ax.add_artist(labels)
+        return labels
 
     def marktext(self, x, y, text='', mark='×', textpos='right', stroke=False,
             bbox=None, family='plotplus', markfontsize=None, **kwargs):
@@ -875,7 +989,11 @@ class Plot:
             self.latmax, self.lonmin, self.lonmax))
         self.save(path)
 
-    def save(self, path, **kwargs):
+    @profiled('save')
+    def save(self, path, layout=None, **kwargs):
+        """Save plot cropped to its content. Plots of a `layout` name, e.g.
+        of one product, are declared to have the same extents whenever their
+        figure, map and texts are alike, see `fix_layout`."""
         self.ax.text(1, 1.01, self.mmnote, ha='right', transform=self.ax.transAxes,
             fontsize=self.fontsize['mmnote'], family=self.family)
         self.ax.axis('off')
@@ -886,11 +1004,284 @@ class Plot:
             self.fig.subplots_adjust(bottom=0, top=1, left=0, right=1)
             self.fig.savefig(path, dpi=self.dpi, pad_inches=0., **kwargs)
         else:
-            self.fig.savefig(path, dpi=self.dpi, bbox_inches='tight', edgecolor='none',
-                pad_inches=0.04, **kwargs)
+            key = self._layout_key()
+            if layout is not None:
+                key = (layout,) + key
+                fix_layout(key)
+            save_figure(self.fig, path, key, dpi=self.dpi, pad_inches=0.04,
+                edgecolor='none', **kwargs)
+
+    def _layout_key(self):
+        """Plots sharing this key are cropped alike: same figure, axes and
+        map, and texts placed alike with the same length."""
+        axes = tuple((type(ax).__name__, tuple(np.round(ax.get_position().bounds,
+            4))) for ax in self.fig.axes)
+        texts = tuple((tuple(np.round(t.get_position(), 4)), t.get_ha(),
+            t.get_va(), t.get_fontsize(), len(t.get_text())) for t in self.ax.texts)
+        return (tuple(self.fig.get_size_inches()), self.dpi,
+            self.ax.projection.proj4_init, tuple(np.round(self.ax.get_extent(), 4)),
+            axes, texts)
 
     def clear(self):
-        plt.clf()
+        release_figure(self.fig)
+
+
+_layouts_ = {}
+_fixed_layouts_ = set()
+
+def fix_layout(key):
+    """Declare that figures of layout `key` have the same extents, i.e.
+    everything near their edges, like colorbar tick labels, is the same. Their
+    measured box is reused without checking."""
+    _fixed_layouts_.add(key)
+
+def save_figure(fig, path, key, dpi, pad_inches=0.04, check=None, **kwargs):
+    """Save figure cropped like `bbox_inches='tight'`, which lays out or even
+    draws the figure once more just to measure it. The box measured on the
+    first figure of each layout `key` is reused for later figures of the key.
+    Unless the key is declared with `fix_layout`, or `check` is False, the
+    figure is measured again after saving, which costs most of what reusing
+    the box saves, and saved again with its own tight box if it differs."""
+    if check is None:
+        check = key not in _fixed_layouts_
+    bbox = _layouts_.get(key)
+    if bbox is None:
+        fig.savefig(path, dpi=dpi, bbox_inches='tight', pad_inches=pad_inches,
+            **kwargs)
+        _layouts_[key] = tight_bbox(fig, dpi, pad_inches)
+        return
+    fig.savefig(path, dpi=dpi, bbox_inches=bbox, **kwargs)
+    if check:
+        tight = tight_bbox(fig, dpi, pad_inches)
+        # Half a pixel of slack for rounding of text extents. A smaller box
+        # is saved again too, or the margins would keep the largest extents
+        # seen so far.
+        if np.abs(tight.get_points() - bbox.get_points()).max() > 0.5 / dpi:
+            _layouts_[key] = tight
+            fig.savefig(path, dpi=dpi, bbox_inches=tight, **kwargs)
+
+def tight_bbox(fig, dpi, pad_inches):
+    """Tight box of figure in inches as savefig would measure it at `dpi`."""
+    figure_dpi = fig.dpi
+    fig.dpi = dpi
+    try:
+        return fig.get_tightbbox(fig.canvas.get_renderer()).padded(pad_inches)
+    finally:
+        fig.dpi = figure_dpi
+
+
+class ValueLabels(martist.Artist):
+    """Many short texts of one style, like values at grid points, as a single
+    artist. With Agg, each distinct string is rasterized once per draw and its
+    pixels are stamped at every position, which saves creating, laying out
+    and drawing a Text artist per label. Other renderers draw one shared Text
+    at every position."""
+
+    def __init__(self, x, y, texts, transform, zorder=3, **textprops):
+        super().__init__()
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.texts = list(texts)
+        self.set_transform(transform)
+        self.set_zorder(zorder)
+        # Unclipped by default, like texts of Axes.text.
+        self.set_clip_on(textprops.pop('clip_on', False))
+        self.prototype = mtext.Text(0, 0, '', **textprops)
+        self.prototype.set_transform(mtransforms.IdentityTransform())
+
+    def set_figure(self, fig):
+        super().set_figure(fig)
+        self.prototype.set_figure(fig)
+
+    def _visible_labels(self):
+        points = self.get_transform().transform(np.column_stack((self.x, self.y)))
+        finite = np.isfinite(points).all(axis=1)
+        return points[finite], np.array(self.texts)[finite]
+
+    def get_window_extent(self, renderer=None):
+        """Union of the extents of all labels, as of a Text per label, so that
+        tight boxes include labels reaching out of the axes."""
+        points, texts = self._visible_labels()
+        if not self.get_visible() or not len(texts):
+            return mtransforms.Bbox.null()
+        if renderer is None:
+            renderer = self.figure.canvas.get_renderer()
+        unique, inverse = np.unique(texts, return_inverse=True)
+        extents = []
+        for text in unique:
+            self.prototype.set_position((0, 0))
+            self.prototype.set_text(text)
+            extents.append(self.prototype.get_window_extent(renderer).extents
+                if text else (np.inf, np.inf, -np.inf, -np.inf))
+        extents = np.array(extents)[inverse]
+        x0, y0 = (points + extents[:, :2]).min(axis=0)
+        x1, y1 = (points + extents[:, 2:]).max(axis=0)
+        if x0 > x1:
+            return mtransforms.Bbox.null()
+        return mtransforms.Bbox([[x0, y0], [x1, y1]])
+
+    @martist.allow_rasterization
+    def draw(self, renderer):
+        if not self.get_visible() or not self.texts:
+            return
+        from matplotlib.backends.backend_agg import RendererAgg
+        points, texts = self._visible_labels()
+        if not isinstance(renderer, RendererAgg):
+            self.prototype.set_clip_on(self.get_clip_on())
+            self.prototype.set_clip_box(self.get_clip_box())
+            self.prototype.set_clip_path(self.get_clip_path())
+            for (px, py), text in zip(points, texts):
+                self.prototype.set_position((px, py))
+                self.prototype.set_text(text)
+                self.prototype.draw(renderer)
+            self.stale = False
+            return
+        renderer.open_group('valuelabels', gid=self.get_gid())
+        gc = renderer.new_gc()
+        self._set_gc_clip(gc)
+        stamps = {}
+        for (px, py), text in zip(points, texts):
+            if text not in stamps:
+                stamps[text] = self._rasterize(renderer, text)
+            if stamps[text] is None:
+                continue
+            # Agg snaps whole texts to pixels as well, labels may only land
+            # one pixel away from where a Text would have put them.
+            image, dx, dy = stamps[text]
+            renderer.draw_image(gc, round(px) + dx, round(py) + dy, image)
+        gc.restore()
+        renderer.close_group('valuelabels')
+        self.stale = False
+
+    def _rasterize(self, renderer, text):
+        """Pixels of text drawn alone, cropped to its ink, and offset of their
+        lower left corner from the anchor point of the text."""
+        from matplotlib.backends.backend_agg import RendererAgg
+        proto = self.prototype
+        proto.set_clip_box(None)
+        proto.set_clip_path(None)
+        proto.set_position((0, 0))
+        proto.set_text(text)
+        bbox = proto.get_window_extent(renderer)
+        # Room for strokes of path effects around the glyphs.
+        pad = int(np.ceil(renderer.points_to_pixels(2.))) + 2
+        anchor_x = pad - int(np.floor(bbox.x0))
+        anchor_y = pad - int(np.floor(bbox.y0))
+        width = int(np.ceil(bbox.width)) + 2 * pad + 1
+        height = int(np.ceil(bbox.height)) + 2 * pad + 1
+        offscreen = RendererAgg(width, height, renderer.dpi)
+        proto.set_position((anchor_x, anchor_y))
+        proto.draw(offscreen)
+        image = np.frombuffer(offscreen.buffer_rgba(), np.uint8).reshape(
+            height, width, 4)
+        rows = np.flatnonzero(image[..., 3].any(axis=1))
+        cols = np.flatnonzero(image[..., 3].any(axis=0))
+        if not len(rows):
+            return None
+        # Rows of the buffer go from top to bottom, images are drawn from
+        # bottom to top.
+        crop = image[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1][::-1].copy()
+        return crop, cols[0] - anchor_x, height - 1 - rows[-1] - anchor_y
+
+
+_projected_paths_ = OrderedDict()
+_feature_cache_dir_ = None
+
+def set_feature_cache_dir(directory):
+    """Also keep projected feature paths as files in `directory`, so that they
+    are shared by processes and survive restarts of worker processes."""
+    global _feature_cache_dir_
+    _feature_cache_dir_ = directory
+
+def get_projected_path(key, project):
+    if key in _projected_paths_:
+        _projected_paths_.move_to_end(key)
+        return _projected_paths_[key]
+    path = None
+    if _feature_cache_dir_:
+        filename = os.path.join(_feature_cache_dir_, hashlib.md5(
+            repr(key).encode()).hexdigest() + '.path')
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                path = pickle.load(f)
+    if path is None:
+        path = project()
+        if _feature_cache_dir_:
+            os.makedirs(_feature_cache_dir_, exist_ok=True)
+            with open(filename + '.tmp', 'wb') as f:
+                pickle.dump(path, f)
+            os.replace(filename + '.tmp', filename)
+    _projected_paths_[key] = path
+    if len(_projected_paths_) > _max_cached_features:
+        _projected_paths_.popitem(last=False)
+    return path
+
+
+_projected_coords_ = OrderedDict()
+_coords_cache_dir_ = None
+
+def set_coords_cache_dir(directory):
+    """Also keep projected grid coordinates as files in `directory`."""
+    global _coords_cache_dir_
+    _coords_cache_dir_ = directory
+
+def get_projected_coords(key, project):
+    if key in _projected_coords_:
+        _projected_coords_.move_to_end(key)
+        return _projected_coords_[key]
+    coords = None
+    if _coords_cache_dir_:
+        filename = os.path.join(_coords_cache_dir_, hashlib.md5(
+            repr(key).encode()).hexdigest() + '.npy')
+        if os.path.exists(filename):
+            coords = tuple(np.load(filename))
+    if coords is None:
+        coords = project()
+        if _coords_cache_dir_:
+            os.makedirs(_coords_cache_dir_, exist_ok=True)
+            with open(filename + '.tmp', 'wb') as f:
+                np.save(f, np.stack(coords))
+            os.replace(filename + '.tmp', filename)
+    # Shared by all later plots, so nobody may modify them in place.
+    for c in coords:
+        c.flags.writeable = False
+    _projected_coords_[key] = coords
+    if len(_projected_coords_) > _max_cached_coords:
+        _projected_coords_.popitem(last=False)
+    return coords
+
+
+class InterpolationPlan:
+    """Everything of interpolating fields of an even grid onto a grid `ip`
+    times finer which doesn't depend on the field: target grid and sampling
+    coordinates."""
+
+    def __init__(self, x, y, georange, res, ip, order=3):
+        latmin, latmax, lonmin, lonmax = georange
+        nx = np.arange(lonmin, lonmax+res/ip, res/ip)
+        ny = np.arange(latmin, latmax+res/ip, res/ip)
+        self.xx, self.yy = np.meshgrid(nx, ny)
+        xcoords = (len(x)-1)*(self.xx-x[0])/(x[-1]-x[0])
+        ycoords = (len(y)-1)*(self.yy-y[0])/(y[-1]-y[0])
+        self.coords = np.array([ycoords, xcoords])
+        self.order = order
+
+    def apply(self, data):
+        return snd.map_coordinates(data, self.coords, order=self.order,
+            mode='nearest')
+
+
+_interpolation_plans_ = OrderedDict()
+
+def get_interpolation_plan(key, build):
+    if key in _interpolation_plans_:
+        _interpolation_plans_.move_to_end(key)
+        return _interpolation_plans_[key]
+    plan = build()
+    _interpolation_plans_[key] = plan
+    if len(_interpolation_plans_) > _max_cached_coords:
+        _interpolation_plans_.popitem(last=False)
+    return plan
 
 
 def merge_dict(a, b):
@@ -914,8 +1305,8 @@ class MapSet:
 
     To address this problem I create a reusable mapset for Cartopy. It will
     calculate desired geometries upon initiating, which is reusable and fully
-    compatible with Cartopy functions. It can also be saved as a file by
-    pickle, further reducing overhead time.
+    compatible with Cartopy functions. It can also be saved as a compact
+    binary file, which is memory-mapped and decoded lazily on load.
 
     Example code:
     ```
@@ -949,6 +1340,8 @@ class MapSet:
         self.city = city
         self.county = county
         self.proj_params = proj_params
+        self.key = None
+        self.source = None
 
     @classmethod
     def from_natural_earth(cls, georange=None, scale='50m', proj='P',
@@ -968,14 +1361,40 @@ class MapSet:
                 scale, georange=georange)
         return ins
 
+    layers = ('coastline', 'country', 'land', 'ocean', 'province', 'city',
+        'county')
+
     @classmethod
     def load(cls, filename):
-        with open(filename, 'rb') as f:
-            return pickle.load(f)
+        """Load mapset file, see `tools.metplot.mapformat`. Geometries are
+        memory-mapped and built lazily, so this costs almost nothing. Old
+        pickled mapsets are still readable."""
+        if is_mapset_file(filename):
+            meta, layers = read_mapset(filename)
+            proj_params = meta['proj_params']
+            if proj_params:
+                proj_params = {k: tuple(v) if isinstance(v, list) else v
+                    for k, v in proj_params.items()}
+            ins = cls(proj=meta['proj'], georange=tuple(meta['georange']),
+                scale=meta['scale'], proj_params=proj_params, **layers)
+            ins.source = meta.get('source')
+        else:
+            with open(filename, 'rb') as f:
+                ins = pickle.load(f)
+        # Identifies geometries of the mapset in caches of projected paths.
+        ins.key = '{}@{:.0f}'.format(os.path.abspath(filename),
+            os.path.getmtime(filename))
+        return ins
 
     def save(self, filename):
-        with open(filename, 'wb') as f:
-            pickle.dump(self, f)
+        if self.proj is not None and not isinstance(self.proj, str):
+            raise PlotError('Only mapsets with projection given by name can be '
+                'saved.')
+        meta = dict(proj=self.proj, georange=self.georange, scale=self.scale,
+            proj_params=self.proj_params, source=getattr(self, 'source', None))
+        layers = {name: getattr(self, name).geometries() for name in self.layers
+            if getattr(self, name)}
+        write_mapset(filename, meta, layers)
 
 
 class PartialShapelyFeature(cfeature.ShapelyFeature):
@@ -1020,14 +1439,37 @@ class PartialNaturalEarthFeature(cfeature.NaturalEarthFeature):
         return iter(self._geoms)
 
     def make_partial(self):
-        path = ciosr.natural_earth(resolution=self.scale,
-            category=self.category, name=self.name)
-        self._geoms = tuple(ciosr.Reader(path).geometries())
+        geoms, bounds = load_natural_earth(self.category, self.name, self.scale)
         if self.extent[0] < 180 < self.extent[1]:
             extent1 = self.extent[0], 180., self.extent[2], self.extent[3]
             extent2 = (-180., self.extent[1] - 360.,
                 self.extent[2], self.extent[3])
-            self._geoms = list(super().intersecting_geometries(extent1)) +\
-                list(super().intersecting_geometries(extent2))
+            self._geoms = select_geometries(geoms, bounds, extent1) +\
+                select_geometries(geoms, bounds, extent2)
         else:
-            self._geoms = list(super().intersecting_geometries(self.extent))
+            self._geoms = select_geometries(geoms, bounds, self.extent)
+
+
+_natural_earth_layers_ = {}
+
+def load_natural_earth(category, name, scale):
+    """All geometries of a Natural Earth shapefile with their bounds as an
+    array, read once per process and shared by all regions clipped from it."""
+    key = category, name, scale
+    if key not in _natural_earth_layers_:
+        path = ciosr.natural_earth(resolution=scale, category=category, name=name)
+        geoms = [g for g in ciosr.Reader(path).geometries() if g is not None]
+        bounds = np.array([g.bounds for g in geoms], dtype=np.float64).reshape(-1, 4)
+        _natural_earth_layers_[key] = geoms, bounds
+    return _natural_earth_layers_[key]
+
+def select_geometries(geoms, bounds, extent):
+    """Geometries intersecting extent (x0, x1, y0, y1) in shapefile order, as
+    `intersecting_geometries` of cartopy features gives them. Bounds rule out
+    most geometries before any exact test."""
+    from shapely.geometry import box
+    x0, x1, y0, y1 = extent
+    extent_geom = box(x0, y0, x1, y1)
+    hit = (bounds[:, 0] <= x1) & (bounds[:, 2] >= x0) & \
+        (bounds[:, 1] <= y1) & (bounds[:, 3] >= y0)
+    return [geoms[i] for i in np.flatnonzero(hit) if extent_geom.intersects(geoms[i])]
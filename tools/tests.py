@@ -0,0 +1,392 @@
+import importlib
+import unittest
+
+
+class ImportTest(unittest.TestCase):
+
+    def test_import_plotplus(self):
+        plotplus = importlib.import_module('tools.metplot.plotplus')
+        self.assertTrue(hasattr(plotplus.Plot, 'save'))
+        self.assertTrue(callable(plotplus.set_profiler))
+
+
+class FigurePoolTest(unittest.TestCase):
+
+    def test_resized_figure_is_reused(self):
+        import matplotlib
+        matplotlib.use('Agg')
+        from tools.metplot.plotplus import Plot
+        plot = Plot(figsize=(6.3, 4.5))
+        fig = plot.fig
+        # As setmap does to fit the aspect of the map.
+        plot.ax = fig.add_axes([0, 0, 1, 1])
+        fig.set_size_inches(4.5, 4.5)
+        fig.subplots_adjust(left=0.2)
+        plot.clear()
+        plot = Plot(figsize=(6.3, 4.5))
+        self.assertIs(plot.fig, fig)
+        self.assertEqual(tuple(fig.get_size_inches()), (6.3, 4.5))
+        self.assertEqual(fig.get_axes(), [])
+        self.assertEqual(fig.subplotpars.left,
+            matplotlib.rcParams['figure.subplot.left'])
+        plot.clear()
+
+
+class FakeFTP:
+
+    def voidcmd(self, cmd):
+        return '200 OK'
+
+    def close(self):
+        pass
+
+
+class FTPConnectionPoolTest(unittest.TestCase):
+
+    def make_pool(self, size):
+        from tools.fastdown import FTPConnectionPool
+        pool = FTPConnectionPool('localhost', size=size)
+        pool.connect = FakeFTP
+        return pool
+
+    def test_broken_release_wakes_waiter(self):
+        import threading
+        pool = self.make_pool(1)
+        ftp = pool.acquire()
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()),
+            daemon=True)
+        waiter.start()
+        waiter.join(0.2)
+        self.assertTrue(waiter.is_alive())
+        pool.release(ftp, broken=True)
+        waiter.join(5)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(len(acquired), 1)
+        self.assertIsNot(acquired[0], ftp)
+        self.assertEqual(pool.created, 1)
+
+    def test_ping_eviction_wakes_waiter(self):
+        import threading
+        pool = self.make_pool(1)
+        ftp = pool.acquire()
+        pool.release(ftp)
+        pinging = threading.Event()
+        dead = threading.Event()
+
+        def noop(cmd):
+            pinging.set()
+            dead.wait(5)
+            raise EOFError
+        ftp.voidcmd = noop
+        pinger = threading.Thread(target=pool.ping, daemon=True)
+        pinger.start()
+        pinging.wait(5)
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()),
+            daemon=True)
+        waiter.start()
+        waiter.join(0.2)
+        self.assertTrue(waiter.is_alive())
+        dead.set()
+        pinger.join(5)
+        waiter.join(5)
+        self.assertFalse(waiter.is_alive())
+        self.assertIsNot(acquired[0], ftp)
+        self.assertEqual(pool.created, 1)
+
+
+try:
+    import pyftpdlib
+except ImportError:
+    pyftpdlib = None
+
+
+@unittest.skipIf(pyftpdlib is None, 'pyftpdlib is not installed.')
+class PooledFTPFastDownTest(unittest.TestCase):
+    """Downloads from a local FTP server, RETR of a file named in `faults`
+    fails once, either with a reply or by dropping the connection."""
+
+    def setUp(self):
+        import os
+        import tempfile
+        import threading
+        from pyftpdlib.authorizers import DummyAuthorizer
+        from pyftpdlib.handlers import FTPHandler
+        from pyftpdlib.servers import ThreadedFTPServer
+        remote = tempfile.mkdtemp()
+        self.local = tempfile.mkdtemp()
+        self.contents = {}
+        for i in range(6):
+            name = '{}.bin'.format(i)
+            self.contents[name] = os.urandom(50000 * (i + 1))
+            with open(os.path.join(remote, name), 'wb') as f:
+                f.write(self.contents[name])
+        self.faults = {}
+        self.logins = 0
+        self.retrs = []
+        test = self
+        authorizer = DummyAuthorizer()
+        authorizer.add_user('wmo', 'essential', remote, perm='elr')
+
+        class Handler(FTPHandler):
+
+            def on_login(self, username):
+                test.logins += 1
+
+            def ftp_RETR(self, file):
+                name = os.path.basename(file)
+                test.retrs.append(name)
+                fault = test.faults.pop(name, None)
+                if fault == 'drop':
+                    self.close()
+                elif fault:
+                    self.respond(fault)
+                else:
+                    return super().ftp_RETR(file)
+
+        Handler.authorizer = authorizer
+        self.server = ThreadedFTPServer(('127.0.0.1', 0), Handler)
+        self.serving = threading.Event()
+        self.serving.set()
+        self.serve_thread = threading.Thread(target=self.serve, daemon=True)
+        self.serve_thread.start()
+        self.pool = None
+
+    def serve(self):
+        while self.serving.is_set():
+            self.server.serve_forever(timeout=0.05, blocking=False)
+        self.server.close_all()
+
+    def tearDown(self):
+        if self.pool is not None:
+            self.pool.close()
+        self.serving.clear()
+        self.serve_thread.join(5)
+
+    def download(self, names, pool_size=2, retry=2):
+        import os
+        from tools.fastdown import FTPConnectionPool, PooledFTPFastDown
+        self.pool = FTPConnectionPool('127.0.0.1', 'wmo', 'essential',
+            port=self.server.address[1], size=pool_size, timeout=5)
+        done = []
+        failed = []
+        downer = PooledFTPFastDown(retry=retry)
+        downer.set_pool(self.pool)
+        downer.set_success_callback(lambda filename, name: done.append(name))
+        downer.set_failed_callback(lambda task: failed.append(task.callback_args))
+        downer.set_task([(name, os.path.join(self.local, name), name)
+            for name in names])
+        downer.download()
+        return done, failed
+
+    def assertDownloaded(self, names):
+        import os
+        for name in names:
+            with open(os.path.join(self.local, name), 'rb') as f:
+                self.assertEqual(f.read(), self.contents[name])
+        self.assertEqual(sorted(os.listdir(self.local)), sorted(names))
+
+    def test_files_are_downloaded_over_the_pool(self):
+        done, failed = self.download(self.contents)
+        self.assertEqual(sorted(done), sorted(self.contents))
+        self.assertEqual(failed, [])
+        self.assertDownloaded(self.contents)
+        self.assertLessEqual(self.logins, 2)
+
+    def test_failed_file_is_retried(self):
+        self.faults['3.bin'] = '451 Try again later.'
+        done, failed = self.download(self.contents)
+        self.assertEqual(failed, ['3.bin'])
+        self.assertEqual(self.retrs.count('3.bin'), 2)
+        self.assertEqual(sorted(done), sorted(self.contents))
+        self.assertDownloaded(self.contents)
+
+    def test_dropped_connection_is_replaced(self):
+        self.faults['2.bin'] = 'drop'
+        done, failed = self.download(self.contents, pool_size=1)
+        self.assertEqual(failed, ['2.bin'])
+        self.assertEqual(sorted(done), sorted(self.contents))
+        self.assertDownloaded(self.contents)
+        self.assertEqual(self.logins, 2)
+        self.assertEqual(self.pool.created, 1)
+
+    def test_gives_up_after_retries(self):
+        with self.assertRaises(IOError):
+            self.download(['0.bin', 'missing.bin'], retry=3)
+        self.assertEqual(self.retrs.count('missing.bin'), 3)
+        # No partial file is left for the missing one.
+        self.assertDownloaded(['0.bin'])
+
+    def test_chunked_download_is_rejected(self):
+        from tools.fastdown import PooledFTPFastDown
+        with self.assertRaises(ValueError):
+            PooledFTPFastDown(chunk_parallel=4, chunk_size=8192)
+
+
+class MapsetFormatTest(unittest.TestCase):
+
+    def test_geometries_round_trip(self):
+        import os
+        import tempfile
+        from shapely.geometry import (GeometryCollection, LineString,
+                                      MultiLineString, MultiPolygon, Point,
+                                      Polygon)
+        from tools.metplot.mapformat import (is_mapset_file, read_mapset,
+                                             write_mapset)
+        square = [(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)]
+        hole = [(2, 2), (4, 2), (4, 4), (2, 4), (2, 2)]
+        other_hole = [(6, 6), (8, 6), (8, 8), (6, 6)]
+        holed = Polygon(square, [hole, other_hole])
+        multi = MultiPolygon([holed, Polygon([(20, 20), (30, 20), (25, 30)])])
+        line = LineString([(0, 0), (5, 5), (10, 0)])
+        lines = MultiLineString([[(0, 0), (1, 1)], [(2, 2), (3, 3), (4, 2)]])
+        # Collections are flattened into their members, empty ones dropped.
+        collection = GeometryCollection([line, GeometryCollection([holed]),
+            Polygon()])
+        filename = os.path.join(tempfile.mkdtemp(), 'test.mapset')
+        write_mapset(filename, {'name': 'test'}, {
+            'polygons': [holed, multi],
+            'lines': [line, lines],
+            'mixed': [collection, LineString()],
+            'empty': []})
+        self.assertTrue(is_mapset_file(filename))
+        meta, layers = read_mapset(filename)
+        self.assertEqual(meta, {'name': 'test'})
+        expected = {'polygons': [holed, multi], 'lines': [line, lines],
+            'mixed': [line, holed], 'empty': []}
+        for name, geoms in expected.items():
+            read = list(layers[name].geometries())
+            self.assertEqual(len(read), len(geoms))
+            for geom, result in zip(geoms, read):
+                self.assertEqual(result.geom_type, geom.geom_type)
+                self.assertTrue(result.equals_exact(geom, 0))
+        self.assertEqual(len(list(layers['polygons'].geometries())[0].interiors), 2)
+        # Only geometries whose bounds meet the extent are built.
+        feature = read_mapset(filename)[1]['polygons']
+        self.assertEqual(list(feature.intersecting_geometries((21, 22, 21, 22))),
+            [feature.geometry(1)])
+        self.assertEqual(list(feature._built), [1])
+        with self.assertRaises(ValueError):
+            write_mapset(filename, {}, {'points': [Point(0, 0)]})
+
+
+class SaveFigureTest(unittest.TestCase):
+
+    def save_twice(self, key, first, second):
+        """Save a figure with a text, then again with the text changed, and
+        return the path of the second image."""
+        import os
+        import tempfile
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        from tools.metplot.plotplus import save_figure
+        tmp = tempfile.mkdtemp()
+        self.fig = plt.figure(figsize=(2, 1))
+        self.addCleanup(plt.close, self.fig)
+        text = self.fig.text(0.5, 0.5, first, ha='center')
+        save_figure(self.fig, os.path.join(tmp, 'a.png'), key, dpi=100)
+        text.set_text(second)
+        path = os.path.join(tmp, 'b.png')
+        save_figure(self.fig, path, key, dpi=100)
+        return path
+
+    def assertSavedTight(self, path):
+        import matplotlib.pyplot as plt
+        from tools.metplot.plotplus import tight_bbox
+        width = plt.imread(path).shape[1]
+        expected = tight_bbox(self.fig, 100, 0.04).width * 100
+        self.assertAlmostEqual(width, expected, delta=1)
+
+    def test_clipped_layout_is_saved_tight(self):
+        # Same key, but the text now reaches far out of the figure.
+        path = self.save_twice(('test', 'clipped'), 'short',
+            'a much longer text than before')
+        self.assertSavedTight(path)
+
+    def test_shrunk_layout_is_saved_tight(self):
+        path = self.save_twice(('test', 'shrunk'),
+            'a much longer text than after', 'short')
+        self.assertSavedTight(path)
+
+    def test_fixed_layout_is_not_measured_again(self):
+        from unittest import mock
+        from tools.metplot import plotplus
+        key = ('test', 'fixed')
+        plotplus.fix_layout(key)
+        with mock.patch.object(plotplus, 'tight_bbox',
+                wraps=plotplus.tight_bbox) as measure:
+            self.save_twice(key, 'text', 'same')
+        self.assertEqual(measure.call_count, 1)
+
+
+class InterpolationPlanTest(unittest.TestCase):
+
+    def check_order(self, order):
+        import numpy as np
+        import scipy.ndimage as snd
+        from tools.metplot.plotplus import InterpolationPlan
+        x = np.arange(70, 140.1, 0.5)
+        y = np.arange(10, 50.1, 0.5)
+        plan = InterpolationPlan(x, y, (10, 50, 70, 140), 0.5, 3, order)
+        rng = np.random.default_rng(order)
+        for dtype in (np.float32, np.float64):
+            field = (rng.normal(size=(len(y), len(x))) * 300).astype(dtype)
+            field[5, 7] = np.nan
+            result = plan.apply(field)
+            self.assertEqual(result.dtype, dtype)
+            self.assertEqual(result.shape, plan.xx.shape)
+            expected = snd.map_coordinates(field, plan.coords, order=order,
+                mode='nearest')
+            np.testing.assert_array_equal(result, expected)
+
+    def test_bilinear_matches_map_coordinates(self):
+        self.check_order(1)
+
+    def test_spline_matches_map_coordinates(self):
+        self.check_order(3)
+
+
+class ValueLabelsTest(unittest.TestCase):
+
+    def test_labels_out_of_axes_are_kept(self):
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        from tools.metplot.plotplus import ValueLabels
+        fig = plt.figure(figsize=(2, 2))
+        ax = fig.add_axes([0.1, 0.1, 0.8, 0.8])
+        labels = ValueLabels([0.5, 1.0], [0.5, 0.5], ['1', '-10'],
+            ax.transAxes, ha='center', va='center')
+        ax.add_artist(labels)
+        renderer = fig.canvas.get_renderer()
+        self.assertFalse(labels.get_clip_on())
+        axes_box = ax.get_window_extent(renderer)
+        self.assertGreater(labels.get_window_extent(renderer).x1, axes_box.x1)
+        self.assertGreater(fig.get_tightbbox(renderer).x1 * fig.dpi, axes_box.x1)
+        # Without a renderer the one of the canvas is used.
+        self.assertEqual(labels.get_window_extent().bounds,
+            labels.get_window_extent(renderer).bounds)
+        plt.close(fig)
+
+    def test_stamp_covers_ink_of_text(self):
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        from tools.metplot.plotplus import ValueLabels
+        fig = plt.figure(figsize=(2, 2))
+        ax = fig.add_axes([0, 0, 1, 1])
+        labels = ValueLabels([0.5], [0.5], ['-10'], ax.transAxes, fontsize=12)
+        ax.add_artist(labels)
+        renderer = fig.canvas.get_renderer()
+        image, dx, dy = labels._rasterize(renderer, '-10')
+        extent = labels.get_window_extent(renderer)
+        height, width, _ = image.shape
+        self.assertLessEqual(abs(width - extent.width), 3)
+        self.assertLessEqual(height, extent.height + 2)
+        # Cropped to the ink.
+        alpha = image[..., 3]
+        for edge in (alpha[0], alpha[-1], alpha[:, 0], alpha[:, -1]):
+            self.assertTrue(edge.any())
+        plt.close(fig)
@@ -14,6 +14,7 @@ from matplotlib.patches import PathPatch
 from scipy.interpolate.rbf import Rbf
 
 from viewer.models import Station, Switch
+from tools import ledger
 from tools.mapstore import load_china_polygon
 from tools.metplot.plotplus import Plot, MapSet
 from tools.utils import utc_last_tick
@@ -192,9 +193,19 @@ class RealTimeDataForTaiwan:
 
 class RealTimeMapRoutine:
 
-    def __init__(self, _debug=False):
+    def __init__(self, _debug=False, force=False):
         self.realtime_data = RealTimeData(_debug=_debug)
         self._debug = _debug
+        self.force = force
+
+    def is_rendered(self, output_path, *parts):
+        """Skip a map if it has been rendered from identical data (e.g. task is
+        retried within the hour), see `tools.ledger`."""
+        self.fingerprint = ledger.fingerprint(*parts, self.time, data=(self.data,))
+        if not self.force and ledger.is_rendered(output_path, self.fingerprint):
+            logger.info('Skip unchanged map: {}'.format(output_path))
+            return True
+        return False
 
     def go(self):
         status = Switch.get_status_by_name(settings.SWITCH_WEATHERMAP_SERVICE)
@@ -291,6 +302,14 @@ class RealTimeMapRoutine:
     def plot_region(self, region, georange=None):
         if georange is None:
             georange = REGIONS[region]
+        if self._debug:
+            filename = 'temp_{}_debug.png'.format(region)
+        else:
+            filename = 'temp_{}.png'.format(region)
+        output_path = os.path.join(settings.PROTECTED_ROOT, 'latest/weather/realtime',
+            filename)
+        if self.is_rendered(output_path, 'temp', region, georange):
+            return
         p = Plot(figsize=(8,6), aspect='cos', inside_axis=True)
         mapset = MapSet.from_natural_earth(georange=georange, country=False)
         p.usemapset(mapset)
@@ -318,14 +337,9 @@ class RealTimeMapRoutine:
         patch = PathPatch(self.china_polygon, transform=p.ax.transData)
         for col in cs.collections:
             col.set_clip_path(patch)
-        if self._debug:
-            filename = 'temp_{}_debug.png'.format(region)
-        else:
-            filename = 'temp_{}.png'.format(region)
-        output_path = os.path.join(settings.PROTECTED_ROOT, 'latest/weather/realtime',
-            filename)
         p.save(output_path)
         p.clear()
+        ledger.record(output_path, self.fingerprint)
         filename_hour = 'temp_{}_{:02d}.png'.format(region, self.time.hour)
         copied_path = os.path.join(settings.PROTECTED_ROOT, 'latest/weather/realtime',
             filename_hour)
@@ -340,6 +354,15 @@ class RealTimeMapRoutine:
         self._plot_diff(pts, georange=region)
 
     def _plot_diff(self, pts, georange=None):
+        region = 'chinadiff'
+        if self._debug:
+            filename = 'temp_{}_debug.png'.format(region)
+        else:
+            filename = 'temp_{}.png'.format(region)
+        output_path = os.path.join(settings.PROTECTED_ROOT,
+            'latest/weather/realtime', filename)
+        if self.is_rendered(output_path, 'tempdiff', georange):
+            return
         p = Plot(figsize=(8,6), aspect='cos', inside_axis=True)
         mapset = MapSet.from_natural_earth(georange=georange, country=False)
         p.usemapset(mapset)
@@ -378,16 +401,9 @@ class RealTimeMapRoutine:
         patch = PathPatch(self.china_polygon, transform=p.ax.transData)
         for col in cs.collections:
             col.set_clip_path(patch)
-        # save
-        region = 'chinadiff'
-        if self._debug:
-            filename = 'temp_{}_debug.png'.format(region)
-        else:
-            filename = 'temp_{}.png'.format(region)
-        output_path = os.path.join(settings.PROTECTED_ROOT,
-            'latest/weather/realtime', filename)
         p.save(output_path)
         p.clear()
+        ledger.record(output_path, self.fingerprint)
         filename_hour = 'temp_{}_{:02d}.png'.format(region, self.time.hour)
         copied_path = os.path.join(settings.PROTECTED_ROOT,
             'latest/weather/realtime', filename_hour)
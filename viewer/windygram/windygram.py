@@ -14,6 +14,9 @@ import matplotlib.transforms as mtrans
 import numpy as np
 from matplotlib.patheffects import Normal, Stroke
 
+from tools.metplot.figpool import acquire_figure, release_figure
+from tools.metplot.plotplus import save_figure
+
 from .cell import Cell, CellRow
 from .gpf import pure_cmap
 from .weathercode import WeatherCode
@@ -83,16 +86,19 @@ class Windygram:
 
     def plot_and_save(self, target):
         self.init_plot()
-        self.plot_perci()
-        self.plot_temp()
-        self.plot_daily()
-        self.plot_extended()
-        self.plot_wind()
-        self.plot_rh()
-        self.plot_sounding()
-        self.plot_weathercode()
-        self.plot_name()
-        self.save_plot(target)
+        try:
+            self.plot_perci()
+            self.plot_temp()
+            self.plot_daily()
+            self.plot_extended()
+            self.plot_wind()
+            self.plot_rh()
+            self.plot_sounding()
+            self.plot_weathercode()
+            self.plot_name()
+            self.save_plot(target)
+        finally:
+            release_figure(self.fig)
 
     def init_plot(self, figsize=None, dpi=None):
         if figsize is None:
@@ -100,7 +106,7 @@ class Windygram:
         if dpi is None:
             dpi = 250
         self.dpi = dpi
-        self.fig = plt.figure(figsize=figsize)
+        self.fig = acquire_figure(figsize)
         self.ax = plt.gca()
         self.ax.xaxis.set_major_locator(mdt.HourLocator(byhour=(0,12)))
         self.ax.xaxis.set_major_formatter(mdt.DateFormatter('%d/%HZ'))
@@ -502,5 +508,6 @@ class Windygram:
         self.ax.xaxis.set_major_formatter(mdt.DateFormatter('%d/%HZ'))
         plt.xlim([self.times[0] - THREEHOUR, self.times[-1] + THREEHOUR])
         self.filename = target
-        self.fig.savefig(target, dpi=self.dpi, bbox_inches='tight', edgecolor='none',
-                         pad_inches=0.05)
+        layout = 'windygram', tuple(self.fig.get_size_inches()), len(self.times)
+        save_figure(self.fig, target, layout, dpi=self.dpi, pad_inches=0.05,
+            check=True, edgecolor='none')
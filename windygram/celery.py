@@ -76,6 +76,14 @@ app.conf.update(
 )
 app.conf.worker_concurrency = 1
 app.conf.worker_max_tasks_per_child = 24
+# Model plots are dispatched as chords of hundreds of small batch tasks per
+# run. Chord callbacks need a result backend, unless settings name one the
+# results go to the redis of the broker. They are only read by the callbacks,
+# so keep them shortly.
+app.add_defaults(lambda: {'result_backend': app.conf.broker_url})
+app.conf.result_expires = 6 * 3600
+# Plot tasks take seconds each, prefetching more would defeat priorities.
+app.conf.worker_prefetch_multiplier = 1
 
 # Load task modules from all registered Django app configs.
 app.autodiscover_tasks()